@@ -27,17 +27,112 @@
 # ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 # POSSIBILITY OF SUCH DAMAGE.
 
+import os, sys
 import datetime as dt
+from instrument import phase
+
+def _strToDatetime (s, fromisoformat = dt.datetime.fromisoformat) :
+    # Fields written by str(datetime.datetime) are parsed by fromisoformat
+    # when listToDatetime would give the same result: separators at fixed
+    # positions, nothing but seconds after minutes. Characters 4, 7, 10
+    # and 13 are the separators.
+    if s[4:16:3] == '-- :':
+        tail = s[16:]
+        if not tail or (tail[0] == ':' and not ' ' in tail):
+            try:
+                return fromisoformat (s[:16])
+            except ValueError:
+                pass
+    return Activity.listToDatetime (s)
 
 class TagError (BaseException) :
     pass
 
+class TagRegistry (object) :
+    """
+    Small integer identifiers of tags
+
+      A set of tags is represented by the integer mask whose bit i is set if
+      the set contains the tag of identifier i, so that membership, union and
+      intersection tests become bitwise operations. Tags are registered the
+      first time they are met and keep their identifier.
+    """
+    def __init__ (self) :
+        self.names = []
+        self.ids = {}
+        self._masks = {}
+        self._sets = {0 : frozenset ()}
+
+    def id (self, tag) :
+        """
+        Return the identifier of a tag, registering the tag if needed
+        """
+        i = self.ids.get (tag)
+        if i is None:
+            i = len (self.names)
+            tag = sys.intern (tag)
+            self.names.append (tag)
+            self.ids [tag] = i
+        return i
+
+    def mask (self, tags) :
+        """
+        Return the mask of an iterable of tags
+
+          Masks of frozen sets, as the tag sets shared by activities, are
+          computed once.
+        """
+        if isinstance (tags, frozenset):
+            m = self._masks.get (tags)
+            if m is None:
+                m = self._mask (tags)
+                self._masks [tags] = m
+            return m
+        return self._mask (tags)
+
+    def _mask (self, tags) :
+        m = 0
+        for t in tags:
+            m |= 1 << self.id (t)
+        return m
+
+    def tagSet (self, mask) :
+        """
+        Return the frozen set of tags of a mask, shared by activities
+        """
+        result = self._sets.get (mask)
+        if result is None:
+            result = Activity.internTags (self.iterTags (mask))
+            self._sets [mask] = result
+        return result
+
+    def iterTags (self, mask) :
+        """
+        Iterate over the tags of a mask by increasing identifier
+        """
+        i = 0
+        while mask:
+            if mask & 1:
+                yield self.names [i]
+            mask >>= 1
+            i += 1
+
 class Activity (object):
     """
     Atomic activity with a time and a list of tags that will enable users to
     sum up the time spent for given tags.
     An activity is included in a unique day
     """
+    __slots__ = ('startTime', 'endTime', 'description', 'instanceTags')
+    """
+    Members of instances:
+      - startTime:    starting time of the activity, a datetime.datetime
+                      object,
+      - endTime:      ending time of the activity, None if not finished,
+      - description:  a string,
+      - instanceTags: the tags of the activity, a frozen set shared by all
+                      activities with the same tags (see internTags).
+    """
     tags = set([])
     """
     The list of tags this activity is related to
@@ -46,25 +141,109 @@ class Activity (object):
     """
     A set of tags that realizes a partitions of all activities
     """
-    startTime = None
-    """
-    Starting time of the activity: a datetime.datetime object
-    """
-    endTime = None
+    tagSets = {}
     """
-    Ending time of the activity
+    Frozen sets of tags shared by activities
     """
-    description = ""
-
     nbMembers = 4
     """
     Number of members written in file for each activity
     """
+    partitionFiles = {}
+    """
+    Modification times of the partition files already read
+    """
+    tagFields = {}
+    """
+    Frozen sets of tags by field of activity file already parsed
+    """
+    registry = TagRegistry ()
+    """
+    Identifiers of tags used to represent sets of tags by bitmasks
+    """
+    _classMasks = {}
+    _partitionVerdicts = (None, 0, {})
+
+    @staticmethod
+    def _classMask (tags) :
+        # Class sets of tags only grow: their mask is computed again when
+        # their size changed.
+        cached = Activity._classMasks.get (id (tags))
+        if cached is None or cached [0] is not tags or \
+                cached [1] != len (tags):
+            cached = (tags, len (tags), Activity.registry.mask (tags))
+            Activity._classMasks [id (tags)] = cached
+        return cached [2]
+
+    @staticmethod
+    def partitionMask () :
+        """
+        Return the mask of the tags of the partition
+        """
+        return Activity._classMask (Activity.partition)
+
+    @staticmethod
+    def knownMask () :
+        """
+        Return the mask of the known tags
+        """
+        return Activity._classMask (Activity.tags)
+
+    def inPartition (self) :
+        """
+        Whether the activity has one and only one tag of the partition
+
+          The test is done once by set of tags and partition.
+        """
+        partition, size, verdicts = Activity._partitionVerdicts
+        if partition is not Activity.partition or size != len (partition):
+            partition = Activity.partition
+            verdicts = {}
+            Activity._partitionVerdicts = (partition, len (partition),
+                                           verdicts)
+        result = verdicts.get (self.instanceTags)
+        if result is None:
+            m = Activity.registry.mask (self.instanceTags) & \
+                Activity.partitionMask ()
+            result = m != 0 and m & (m - 1) == 0
+            verdicts [self.instanceTags] = result
+        return result
+
     @staticmethod
     def readPartition (filename):
-        with open (filename, 'r') as f:
+        """
+        Add the tags listed in a file to the partition
+
+          The file is not read again if it did not change since last call.
+        """
+        mtime = os.stat (filename).st_mtime_ns
+        if Activity.partitionFiles.get (filename) == mtime:
+            return
+        with phase ('read partition'), open (filename, 'r') as f:
             for line in f:
                 Activity.partition.add (line.strip('\n'))
+        Activity.partitionFiles [filename] = mtime
+
+    @staticmethod
+    def internTags (tags) :
+        """
+        Return the frozen set of given tags shared by activities
+
+          Tag strings are interned as well.
+        """
+        tags = frozenset(tags)
+        result = Activity.tagSets.get (tags)
+        if result is None:
+            result = frozenset(map(sys.intern, tags))
+            Activity.tagSets [result] = result
+        return result
+
+    @staticmethod
+    def toMinute (t) :
+        """
+        Round a datetime object down to the minute, as times read in files
+        """
+        return t.replace (second = 0, microsecond = 0)
 
     @staticmethod
     def listToDatetime (strDateAndTime) :
@@ -83,6 +262,45 @@ class Activity (object):
         initList.extend(listTime)
         return dt.datetime(*initList)
     
+    @staticmethod
+    def strToDatetime (s) :
+        """
+        Parse a time written as by str(datetime.datetime)
+
+          Same as listToDatetime, with dates and times of the form
+          "YYYY-MM-DD HH:MM" read at fixed positions. Other strings are
+          passed to listToDatetime.
+        """
+        return _strToDatetime (s)
+
+    @staticmethod
+    def fromLine (line) :
+        """
+        Create an instance from a line of an activity file
+
+          Same as fromList applied to the row read by csv.reader with
+          work_sheet.CsvDialectSemiColon. Line may be a bytes object.
+        """
+        if isinstance (line, bytes):
+            line = line.decode()
+        line = line.rstrip('\r\n')
+        l = line.split(';') if line else []
+        if len (l) != Activity.nbMembers :
+            raise (IOError ("expect %d element, got %d."%
+                            (Activity.nbMembers, len(l))))
+        a = Activity.__new__ (Activity)
+        a.startTime = _strToDatetime (l[0])
+        a.endTime = None if l[1] == 'None' else _strToDatetime (l[1])
+        a.description = l[2]
+        tags = Activity.tagFields.get (l[3])
+        if tags is None:
+            tags = Activity.internTags (t.strip('"') for t in
+                                        l[3].split('" "'))
+            Activity.tags.update (tags)
+            Activity.tagFields [l[3]] = tags
+        a.instanceTags = tags
+        return a
+
     @staticmethod
     def fromList (l) :
         """
@@ -100,8 +318,8 @@ class Activity (object):
         a.startTime = startTime
         a.endTime = endTime
         a.description = description
-        for t in instanceTags:
-            a.addNewTag(t)
+        a.instanceTags = Activity.internTags (instanceTags)
+        Activity.tags.update (a.instanceTags)
         return a
 
     def __init__(self) :
@@ -109,7 +327,9 @@ class Activity (object):
         Initialize starting time with current time
         """
         self.startTime = dt.datetime.now()
-        self.instanceTags = set()
+        self.endTime = None
+        self.description = ""
+        self.instanceTags = Activity.internTags (())
         
     def addTag(self, tag) :
         """
@@ -120,19 +340,17 @@ class Activity (object):
         if tag not in Activity.tags :
             raise TagError\
                 ("tag %s is unknown. Use addNewTag method for new tags"%tag)
-        self.instanceTags.add (tag)
+        self.instanceTags = Activity.internTags (self.instanceTags | set([tag]))
         
     def addNewTag(self, tag) :
-        self.instanceTags.add (tag)
+        self.instanceTags = Activity.internTags (self.instanceTags | set([tag]))
         Activity.tags.add(tag)
 
     def __str__(self) :
-        string = "{};{};{};".format(str(self.startTime), str(self.endTime),
-                                    self.description)
-        for t in self.instanceTags :
-            string += '"{}" '.format(t)
-        string = string[:-1:]
-        return string
+        return '{};{};{};{}'.format(self.startTime, self.endTime,
+                                    self.description,
+                                    ' '.join(['"%s"' % t for t in
+                                              self.instanceTags]))
 
     def __le__(self, other) :
         return self.startTime <= other.startTime
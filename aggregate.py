@@ -0,0 +1,279 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2010, 2011 CNRS
+# Author: Florent Lamiraux
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED
+# TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Aggregation of activity times by tag and by period
+
+  Functions of this module return dictionaries of times in hours. Durations
+  are computed once from the columns of the work sheet. If NumPy is
+  available, grouped sums are vectorized, otherwise they are computed in pure
+  Python. Activities are counted in the period they start in and unfinished
+  activities count for zero.
+"""
+
+import datetime as dt
+from activity import Activity
+from work_sheet import secondsPerDay
+from columnar import ActivityColumns, ColumnarWorkSheet, noTime, epoch, \
+    _epochOrdinal
+from instrument import phase
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+periods = ('day', 'week', 'month')
+
+def periodKey (period, day) :
+    """
+    Return the integer key of the day, week or month containing a day
+
+      Input:
+        - day: the number of days since 1970-01-01.
+      Keys of consecutive periods are consecutive integers. See
+      Aggregator._periods for arrays of days.
+    """
+    if period == 'day':
+        return day
+    if period == 'week':
+        # 1970-01-01 is a Thursday
+        return (day + 3) // 7
+    if period == 'month':
+        date = dt.date.fromordinal(day + _epochOrdinal)
+        return 12*(date.year - 1970) + date.month - 1
+    raise ValueError("unknown period %r." % period)
+
+def periodFirstDay (period, key) :
+    """
+    Return the first day of a period as a number of days since 1970-01-01
+    """
+    if period == 'day':
+        return key
+    if period == 'week':
+        return 7*key - 3
+    if period == 'month':
+        return dt.date(1970 + key // 12, key % 12 + 1, 1).toordinal() - \
+            _epochOrdinal
+    raise ValueError("unknown period %r." % period)
+
+def periodLabel (period, key) :
+    """
+    Convert a key returned by periodKey to a datetime.date object for days
+    and weeks (the Monday), to a (year, month) tuple for months
+    """
+    if period == 'month':
+        return (1970 + key // 12, key % 12 + 1)
+    return dt.date.fromordinal(periodFirstDay(period, key) + _epochOrdinal)
+
+def formatPeriod (label) :
+    """
+    Write a label returned by periodLabel as YYYY-MM-DD, or YYYY-MM for
+    months
+    """
+    if isinstance(label, tuple):
+        return '%04d-%02d' % label
+    return label.isoformat()
+
+def _columns (w) :
+    """
+    Return the columns of a work sheet, building them if needed
+    """
+    if isinstance(w, ColumnarWorkSheet):
+        return w.activities
+    c = ActivityColumns()
+    for a in w:
+        c.append(a)
+    return c
+
+def _hours (seconds) :
+    return seconds/3600.
+
+class Aggregator (object) :
+    """
+    Durations of the activities of a work sheet, ready for grouped sums
+    """
+    def __init__ (self, w, useNumpy = True) :
+        self.columns = _columns(w)
+        self.useNumpy = useNumpy and np is not None
+        c = self.columns
+        if self.useNumpy:
+            starts = np.frombuffer(c.starts, dtype = np.int64) \
+                if len(c) > 0 else np.zeros(0, dtype = np.int64)
+            ends = np.frombuffer(c.ends, dtype = np.int64) \
+                if len(c) > 0 else np.zeros(0, dtype = np.int64)
+            self.starts = starts
+            self.durations = np.where(ends == noTime, 0, ends - starts)
+        else:
+            self.starts = c.starts
+            self.durations = [0 if e == noTime else e - s
+                              for s, e in zip(c.starts, c.ends)]
+
+    def _sumBy (self, keys) :
+        """
+        Return a dictionary of times in hours summed by key
+
+          Input:
+            - keys: a key for each activity, integer array with NumPy.
+        """
+        if self.useNumpy:
+            values, inverse = np.unique(keys, return_inverse = True)
+            sums = np.bincount(inverse.ravel(), weights = self.durations,
+                               minlength = len(values))
+            return dict((v, _hours(s)) for v, s in
+                        zip(values.tolist(), sums.tolist()))
+        result = {}
+        for k, d in zip(keys, self.durations):
+            result[k] = result.get(k, 0) + d
+        return dict((k, _hours(d)) for k, d in result.items())
+
+    def _days (self) :
+        if self.useNumpy:
+            return self.starts // secondsPerDay
+        return [s // secondsPerDay for s in self.starts]
+
+    def timeByTag (self) :
+        """
+        Return a dictionary giving the total time for each tag
+        """
+        c = self.columns
+        if self.useNumpy and c.nbWords == 1:
+            masks = np.frombuffer(c.masks, dtype = np.uint64) \
+                if len(c) > 0 else np.zeros(0, dtype = np.uint64)
+            byMask = self._sumBy(masks)
+        else:
+            byMask = {}
+            for m, d in zip(c.allMasks(), self.durations):
+                byMask[m] = byMask.get(m, 0) + int(d)
+            byMask = dict((m, _hours(d)) for m, d in byMask.items())
+        result = {}
+        for m, t in byMask.items():
+            for tag in c.tagSet(int(m)):
+                result[tag] = result.get(tag, 0) + t
+        return result
+
+    def timeByPartition (self) :
+        """
+        Return a dictionary giving the total time for each element of the
+        partition present in the work sheet
+        """
+        byTag = self.timeByTag()
+        return dict((p, byTag[p]) for p in Activity.partition if p in byTag)
+
+    def timeByDay (self) :
+        """
+        Return a dictionary giving the total time for each day, keyed by
+        datetime.date objects
+        """
+        return dict(((epoch + dt.timedelta(days = d)).date(), t)
+                    for d, t in self._sumBy(self._days()).items())
+
+    def _periods (self, period) :
+        """
+        Return the key of the day, week or month each activity starts in,
+        see periodKey
+        """
+        days = self._days()
+        if not self.useNumpy:
+            return [periodKey(period, d) for d in days]
+        if period == 'day':
+            return days
+        if period == 'week':
+            return (days + 3) // 7
+        if period == 'month':
+            return days.astype('datetime64[D]').astype('datetime64[M]')\
+                .astype(np.int64)
+        raise ValueError("unknown period %r." % period)
+
+    def timeByWeek (self) :
+        """
+        Return a dictionary giving the total time for each week, keyed by the
+        date of the Monday of the week
+        """
+        return dict((periodLabel('week', w), t)
+                    for w, t in self._sumBy(self._periods('week')).items())
+
+    def timeByMonth (self) :
+        """
+        Return a dictionary giving the total time for each month, keyed by
+        (year, month) tuples
+        """
+        return dict((periodLabel('month', m), t)
+                    for m, t in self._sumBy(self._periods('month')).items())
+
+    def timeByPeriodAndTag (self, period) :
+        """
+        Return a dictionary giving the total time for each period and tag,
+        keyed by (period, tag) tuples
+
+          Input:
+            - period: 'day', 'week' or 'month', see periodLabel for keys.
+        """
+        c = self.columns
+        keys = self._periods(period)
+        if self.useNumpy and c.nbWords == 1 and len(c) > 0:
+            masks = np.frombuffer(c.masks, dtype = np.int64)
+            pairs, inverse = np.unique(np.stack([keys, masks], axis = 1),
+                                       axis = 0, return_inverse = True)
+            sums = np.bincount(inverse.ravel(), weights = self.durations,
+                               minlength = len(pairs))
+            byPair = (((k, m % 2**64), s) for (k, m), s in
+                      zip(pairs.tolist(), sums.tolist()))
+        else:
+            byPair = {}
+            for k, m, d in zip(keys, c.allMasks(), self.durations):
+                byPair[(k, m)] = byPair.get((k, m), 0) + int(d)
+            byPair = byPair.items()
+        result = {}
+        for (k, m), seconds in byPair:
+            label = periodLabel(period, int(k))
+            for tag in c.tagSet(int(m)):
+                result[(label, tag)] = result.get((label, tag), 0) + \
+                    _hours(seconds)
+        return result
+
+def timeByTag (w) :
+    return Aggregator(w).timeByTag()
+
+def timeByPartition (w) :
+    with phase('aggregate'):
+        return Aggregator(w).timeByPartition()
+
+def timeByDay (w) :
+    return Aggregator(w).timeByDay()
+
+def timeByWeek (w) :
+    return Aggregator(w).timeByWeek()
+
+def timeByMonth (w) :
+    return Aggregator(w).timeByMonth()
+
+def timeByPeriodAndTag (w, period) :
+    return Aggregator(w).timeByPeriodAndTag(period)
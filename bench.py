@@ -0,0 +1,427 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2010, 2011 CNRS
+# Author: Florent Lamiraux
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED
+# TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Benchmarks
+
+  Usage: python bench.py [--partition file] [--output file] [--repeat n]
+                         [--no-scripts] [number of activities ...]
+
+  Synthetic activity files of the given numbers of activities (1000, 100000
+  and 1000000 by default) are generated with the tags of the partition file
+  (~/.activity-partition if it exists). Reading, writing and querying them
+  is timed, as well as the scripts start_or_stop.py and statistics.py run on
+  them. Results are printed, or written in the output file, in JSON: best
+  times in seconds over the repetitions. Times to import the modules of the
+  commands of work_logging.py are measured with python -X importtime and
+  compared to work_logging.importBudget.
+"""
+
+import sys, os, time, json, random, csv, tempfile, shutil, subprocess
+import argparse, platform
+import datetime as dt
+from activity import Activity
+from work_sheet import WorkSheet, CsvDialectSemiColon, readFile, readTail, \
+    readSince, iterActivities, filterBetween, sumTimeByTag, _mondayMorning
+from columnar import ActivityColumns, ColumnarWorkSheet, numpyThreshold
+from cache import readCached
+from rollup import Rollup
+from aggregate import timeByPartition, np
+from mapped import readBetween
+
+defaultSizes = [1000, 100000, 1000000]
+defaultPartition = ['administration', 'recherche', 'publication',
+                    'encadrement', 'enseignement', 'divers']
+extraTags = ['hpp', 'cnrs', 'europe', 'urgent']
+words = ['meeting', 'review', 'mails', 'report', 'seminar', 'course',
+         'proposal', 'code', 'paper', 'phone call']
+
+def generateLines (n, seed = 0, partition = None, now = None) :
+    """
+    Generate n lines of a synthetic activity file
+
+      Activities fill working days from 8 am to about 6 pm, up to the day
+      before now. Each one has a tag of the partition, some have other tags
+      as well. The last line is an activity started by start_or_stop.py one
+      hour before now, not finished yet.
+      Input:
+        - partition: list of tags, defaultPartition if None.
+    """
+    rng = random.Random(seed)
+    if partition is None:
+        partition = defaultPartition
+    partition = sorted(partition)
+    if now is None:
+        now = dt.datetime.now()
+    day = dt.datetime(now.year, now.month, now.day)
+    days = []
+    count = 1
+    while count < n:
+        day -= dt.timedelta(days = 1)
+        if day.weekday() >= 5:
+            continue
+        t = day + dt.timedelta(hours = 8, minutes = rng.randint(0, 60))
+        lines = []
+        while t.hour < 18 and count < n:
+            end = t + dt.timedelta(minutes = rng.randint(5, 120))
+            tags = [rng.choice(partition)]
+            r = rng.random()
+            if r < .05:
+                tags.extend(rng.sample(extraTags, 2))
+            elif r < .3:
+                tags.append(rng.choice(extraTags))
+            lines.append('%s;%s;%s %d;%s\n' %
+                         (t, end, rng.choice(words), rng.randint(1, 50),
+                          ' '.join('"%s"' % x for x in tags)))
+            t = end + dt.timedelta(minutes = rng.randint(0, 30))
+            count += 1
+        days.append(lines)
+    lines = [line for l in reversed(days) for line in l]
+    t = now - dt.timedelta(hours = 1)
+    lines.append('%s;None;current activity;"%s"\n' % (t, partition[0]))
+    return lines
+
+def writeActivityFile (filename, n, partition = None, seed = 0) :
+    """
+    Write a synthetic activity file of n activities, see generateLines
+    """
+    with open(filename, 'w') as f:
+        f.writelines(generateLines(n, seed, partition))
+
+def _timeit (function, repeat = 3) :
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        function()
+        duration = time.perf_counter() - start
+        if best is None or duration < best:
+            best = duration
+    return best
+
+parserSpeedup = 5.
+"""
+Minimal speedup of Activity.fromLine, the parser of WorkSheet.read, over
+csv.reader with Activity.fromList
+"""
+
+def benchParser (n, partition = None) :
+    """
+    Compare csv.reader with Activity.fromList to Activity.fromLine and to
+    ActivityColumns.readBytes
+
+      The speedup of Activity.fromLine should be at least parserSpeedup.
+      ActivityColumns.readBytes is timed without numpy and, if available
+      and n is at least columnar.numpyThreshold, with numpy.
+    """
+    lines = generateLines(n, partition = partition)
+    data = ''.join(lines).encode()
+    def readCsv () :
+        return [Activity.fromList(row) for row in
+                csv.reader(lines, dialect = CsvDialectSemiColon())]
+    def readLines () :
+        return [Activity.fromLine(line) for line in lines]
+    def readColumns (useNumpy = False) :
+        c = ActivityColumns()
+        c.readBytes(data, useNumpy)
+        return c
+    def readColumnsNumpy () :
+        return readColumns(True)
+    reference = [(a.startTime, a.endTime, a.description, a.instanceTags)
+                 for a in readCsv()]
+    for parser in (readLines, readColumns, readColumnsNumpy):
+        if reference != [(a.startTime, a.endTime, a.description,
+                          a.instanceTags) for a in parser()]:
+            raise RuntimeError("%s disagrees with csv.reader" %
+                               parser.__name__)
+    tCsv = _timeit(readCsv)
+    tLines = _timeit(readLines)
+    tColumns = _timeit(readColumns)
+    result = {'rows': n, 'csv.reader + fromList': tCsv,
+              'fromLine': tLines, 'ActivityColumns.readBytes': tColumns,
+              'speedup fromLine': tCsv/tLines,
+              'speedup ActivityColumns.readBytes': tCsv/tColumns,
+              'within target': tCsv/tLines >= parserSpeedup}
+    if np is not None and n >= numpyThreshold:
+        tNumpy = _timeit(readColumnsNumpy)
+        result['ActivityColumns.readBytes with numpy'] = tNumpy
+        result['speedup ActivityColumns.readBytes with numpy'] = tCsv/tNumpy
+    return result
+
+def _listToDatetime (s) :
+    # Activity.listToDatetime of the baseline reader
+    if s == 'None':
+        return None
+    dateAndTime = s.split(' ')
+    initList = list(map(int, dateAndTime[0].split('-')))
+    initList.extend(map(int, dateAndTime[1].split(":")[:2]))
+    return dt.datetime(*initList)
+
+def _readCsv (filename) :
+    # WorkSheet.read of the baseline reader: csv.reader, Activity.fromList
+    # and tags inserted one by one in instance and class sets.
+    w = WorkSheet()
+    tags = set()
+    with open(filename, 'r') as f :
+        for row in csv.reader(f, dialect = CsvDialectSemiColon()):
+            startTime = _listToDatetime(row[0])
+            endTime = _listToDatetime(row[1])
+            instanceTags = set()
+            for t in map(lambda s : s.strip('"'), row[3].split('" "')):
+                instanceTags.add(t)
+                tags.add(t)
+            a = Activity()
+            a.startTime, a.endTime, a.description = startTime, endTime, row[2]
+            a.instanceTags = Activity.internTags(instanceTags)
+            w.add(a, True)
+    return w
+
+def benchRead (n, partition = None) :
+    """
+    Compare reading a file with the baseline csv.reader based reader,
+    WorkSheet.read and ColumnarWorkSheet.read
+    """
+    fd, filename = tempfile.mkstemp(suffix = '.activity')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.writelines(generateLines(n, partition = partition))
+        def read () :
+            w = WorkSheet()
+            w.read(filename, True)
+            return w
+        def readColumnar () :
+            w = ColumnarWorkSheet()
+            w.read(filename, True)
+            return w
+        tCsv = _timeit(lambda : _readCsv(filename))
+        tRead = _timeit(read)
+        tColumnar = _timeit(readColumnar)
+    finally:
+        os.remove(filename)
+    return {'rows': n, 'csv.reader': tCsv, 'WorkSheet.read': tRead,
+            'ColumnarWorkSheet.read': tColumnar,
+            'speedup WorkSheet.read': tCsv/tRead,
+            'speedup ColumnarWorkSheet.read': tCsv/tColumnar}
+
+def benchOperations (filename, partition, repeat = 3) :
+    """
+    Time reading, writing and querying an activity file
+    """
+    result = {}
+    def timeit (name, function) :
+        result[name] = _timeit(function, repeat)
+    cacheFile = filename + '.bench-cache'
+    def readCold () :
+        if os.path.exists(cacheFile):
+            os.remove(cacheFile)
+        return readCached(filename, partition, cacheFile)
+    timeit('WorkSheet.read', lambda : readFile(filename, partition))
+    def readColumnar () :
+        w = ColumnarWorkSheet()
+        w.read(filename)
+        return w
+    timeit('ColumnarWorkSheet.read', readColumnar)
+    timeit('readCached (cold)', readCold)
+    timeit('readCached (warm)', lambda : readCached(filename, partition,
+                                                     cacheFile))
+    timeit('readCached columnar (warm)',
+           lambda : readCached(filename, partition, cacheFile, True))
+    os.remove(cacheFile)
+    now = dt.datetime.now()
+    timeit('readTail', lambda : readTail(filename, 3, partition))
+    timeit('readSince (this week)',
+           lambda : readSince(filename, _mondayMorning(now), partition))
+    w = readFile(filename, partition)
+    wc = readColumnar()
+    tmp = filename + '.bench-write'
+    timeit('WorkSheet.write', lambda : w.write(tmp))
+    timeit('ColumnarWorkSheet.write', lambda : wc.write(tmp))
+    os.remove(tmp)
+    middle = w[len(w)//2].startTime
+    tags = sorted(Activity.partition)[:2]
+    for name, sheet in (('WorkSheet', w), ('ColumnarWorkSheet', wc)):
+        operations = [
+            ('extractDay', lambda : sheet.extractDay(middle.year,
+                                                     middle.month,
+                                                     middle.day)),
+            ('extractMonth', lambda : sheet.extractMonth(middle.year,
+                                                         middle.month)),
+            ('extractThisWeek', lambda : sheet.extractThisWeek(now)),
+            ('extractUnion', lambda : sheet.extractUnion(tags)),
+            ('extractInter',
+             lambda : sheet.extractInter(tags + extraTags[:1])),
+            ('totalTime', lambda : sheet.totalTime),
+            ('totalTimeByTag', lambda : sheet.totalTimeByTag()),
+            ('timeByPartition', lambda : timeByPartition(sheet)),
+            ('Rollup.fromWorkSheet', lambda : Rollup.fromWorkSheet(sheet))]
+        for operation, function in operations:
+            timeit('%s.%s' % (name, operation), function)
+    monthStart = dt.datetime(middle.year, middle.month, 1)
+    timeit('readBetween (month)',
+           lambda : readBetween(filename, monthStart, monthStart +
+                                dt.timedelta(days = 31), partition))
+    timeit('iterActivities + sumTimeByTag (this week)',
+           lambda : sumTimeByTag(filterBetween(iterActivities(filename),
+                                               _mondayMorning(now), now)))
+    return result
+
+def _runScript (home, script, stdin = '', args = ()) :
+    env = dict(os.environ, HOME = home)
+    start = time.perf_counter()
+    subprocess.run([sys.executable, os.path.join(os.path.dirname(
+                    os.path.abspath(__file__)), script)] + list(args),
+                   env = env, input = stdin.encode(),
+                   stdout = subprocess.DEVNULL, check = True)
+    return time.perf_counter() - start
+
+def importTime (module) :
+    """
+    Return the time in seconds to import a module in a new interpreter,
+    measured with python -X importtime
+    """
+    p = subprocess.run([sys.executable, '-X', 'importtime', '-c',
+                        'import ' + module], cwd = os.path.dirname(
+            os.path.abspath(__file__)), capture_output = True, check = True)
+    for line in p.stderr.decode().splitlines():
+        fields = line.split('|')
+        if len(fields) == 3 and fields[2].strip() == module:
+            return int(fields[1])*1e-6
+    return None
+
+def benchImports () :
+    """
+    Time the imports of the modules of the commands of work_logging.py
+
+      Modules of the commands toggling activities should be imported within
+      work_logging.importBudget.
+    """
+    from work_logging import importBudget
+    result = {'budget': importBudget}
+    for module in ('work_logging', 'start_or_stop', 'switch_activity',
+                   'statistics'):
+        result[module] = importTime(module)
+    result['within budget'] = all(result[m] <= importBudget for m in
+                                  ('start_or_stop', 'switch_activity'))
+    return result
+
+def benchScripts (filename, partition) :
+    """
+    Time the scripts on a copy of an activity file
+
+      The scripts run in a temporary home directory. Times of start_or_stop
+      include the pause of 2 seconds at the end of the script, unlike times
+      of work_logging.py.
+    """
+    home = tempfile.mkdtemp()
+    try:
+        activityFile = os.path.join(home, '.activity')
+        shutil.copy(filename, activityFile)
+        shutil.copy(partition, activityFile + '-partition')
+        result = {}
+        result['statistics.py (cold)'] = _runScript(home, 'statistics.py')
+        result['statistics.py (warm)'] = _runScript(home, 'statistics.py')
+        # finish the current activity
+        result['start_or_stop.py (stop)'] = \
+            _runScript(home, 'start_or_stop.py')
+        result['statistics.py (after stop)'] = \
+            _runScript(home, 'statistics.py')
+        # start a new activity and stop it
+        with open(partition) as f:
+            tag = f.readline().strip()
+        result['work_logging.py toggle (start)'] = \
+            _runScript(home, 'work_logging.py', 'bench\ny\n%s\nn\n' % tag,
+                       ['toggle'])
+        result['work_logging.py toggle (stop)'] = \
+            _runScript(home, 'work_logging.py', args = ['toggle'])
+        return result
+    finally:
+        shutil.rmtree(home)
+
+def _commit () :
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd =
+                              os.path.dirname(os.path.abspath(__file__)),
+                              capture_output = True, check = True).stdout\
+                              .decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main (argv) :
+    parser = argparse.ArgumentParser(description = "Benchmark work logging")
+    parser.add_argument('sizes', metavar = 'N', type = int, nargs = '*',
+                        default = defaultSizes,
+                        help = "numbers of activities")
+    parser.add_argument('--partition', default = os.path.join(
+            os.getenv('HOME', ''), '.activity-partition'),
+                        help = "partition file")
+    parser.add_argument('--output', help = "JSON result file")
+    parser.add_argument('--repeat', type = int, default = 3,
+                        help = "number of runs of each operation")
+    parser.add_argument('--no-scripts', dest = 'scripts',
+                        action = 'store_false', help = "do not run scripts")
+    args = parser.parse_args(argv)
+    directory = tempfile.mkdtemp()
+    try:
+        partition = os.path.join(directory, 'partition')
+        if os.path.exists(args.partition):
+            shutil.copy(args.partition, partition)
+        else:
+            with open(partition, 'w') as f:
+                f.write('\n'.join(defaultPartition))
+        Activity.readPartition(partition)
+        tags = sorted(Activity.partition)
+        results = {'date': str(dt.datetime.now()), 'commit': _commit(),
+                   'python': platform.python_version(),
+                   'platform': platform.platform(),
+                   'imports': benchImports(), 'sizes': {}}
+        for n in args.sizes:
+            filename = os.path.join(directory, 'activity-%d' % n)
+            writeActivityFile(filename, n, tags)
+            r = {'file size': os.path.getsize(filename),
+                 'parser': benchParser(n, tags),
+                 'read': benchRead(n, tags),
+                 'operations': benchOperations(filename, partition,
+                                               args.repeat)}
+            if args.scripts:
+                r['scripts'] = benchScripts(filename, partition)
+            results['sizes'][n] = r
+            os.remove(filename)
+    finally:
+        shutil.rmtree(directory)
+    text = json.dumps(results, indent = 2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+if __name__ == '__main__':
+    from instrument import parseOptions
+    sys.argv[1:] = parseOptions(sys.argv[1:])
+    main(sys.argv[1:])
@@ -0,0 +1,291 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2010, 2011 CNRS
+# Author: Florent Lamiraux
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED
+# TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Binary cache of activity files
+
+  The cache of file ~/.activity is stored in ~/.activity.cache. It contains
+  starting and ending times as arrays of seconds since 1970-01-01, tag sets as
+  bitmasks over a table of tags and descriptions as a table of strings. The
+  cache is memory-mapped when loaded. When the activity file has grown since
+  the cache was written and its parsed part is unchanged, only the new lines
+  are parsed. Any other modification rebuilds the cache.
+"""
+
+import os, mmap, struct, zlib
+from array import array
+from activity import Activity
+from work_sheet import WorkSheet, isDatabase, atomicWrite
+from columnar import ActivityColumns, ColumnarWorkSheet, lineChunks
+from instrument import phase, count
+
+magic = b'WLC2'
+header = struct.Struct('<4sqqqqqqqq')
+"""
+magic, size and modification time of the activity file, number of bytes
+parsed, checksum of the parsed bytes, number of closing records merged,
+number of activities, number of tags, number of 64 bit words per tag mask.
+"""
+blockSize = 1 << 20
+"""
+Size of the blocks read when checking the parsed part of an activity file.
+"""
+def _pad (n) :
+    return (-n) % 8
+
+class ActivityCache (ActivityColumns) :
+    """
+    Columnar image of an activity file
+
+      Columns are memoryviews on the mapped cache file after load, and arrays
+      once the cache is modified.
+    """
+    def __init__ (self) :
+        ActivityColumns.__init__(self)
+        self.size = 0
+        self.mtime = 0
+        self.offset = 0
+        self.checksum = 0
+        self.journalRecords = 0
+        self._map = None
+
+    @staticmethod
+    def load (cacheFile) :
+        """
+        Map a cache file in memory
+        """
+        with open(cacheFile, 'rb') as f:
+            m = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+        mv = memoryview(m)
+        if len(mv) < header.size:
+            raise IOError("%s: truncated cache file." % cacheFile)
+        (tag, size, mtime, offset, checksum, journalRecords, n, nbTags,
+         nbWords) = header.unpack_from(mv)
+        if tag != magic:
+            raise IOError("%s is not an activity cache." % cacheFile)
+        pos = [header.size]
+        def column(fmt, count) :
+            begin = pos[0]
+            pos[0] += 8*count
+            return mv[begin:pos[0]].cast(fmt)
+        def blob(length) :
+            begin = pos[0]
+            pos[0] += length + _pad(length)
+            return mv[begin:begin+length]
+        c = ActivityCache()
+        c.size, c.mtime, c.offset = size, mtime, offset
+        c.checksum, c.journalRecords = checksum, journalRecords
+        c.nbWords = nbWords
+        tagOffsets = column('q', nbTags + 1)
+        tagData = blob(tagOffsets[-1])
+        c.tagNames = [str(tagData[tagOffsets[i]:tagOffsets[i+1]], 'utf-8')
+                      for i in range(nbTags)]
+        c.tagIds = dict((t, i) for i, t in enumerate(c.tagNames))
+        c.starts = column('q', n)
+        c.ends = column('q', n)
+        c.masks = column('Q', n*nbWords)
+        c.descOffsets = column('q', n + 1)
+        c.descData = blob(c.descOffsets[-1])
+        if pos[0] > len(mv):
+            raise IOError("%s: truncated cache file." % cacheFile)
+        c._map = m
+        c._readOnly = True
+        return c
+
+    def save (self, cacheFile) :
+        """
+        Write the cache in a file, see work_sheet.atomicWrite
+        """
+        tagData = bytearray()
+        tagOffsets = array('q', [0])
+        for t in self.tagNames:
+            tagData += t.encode('utf-8')
+            tagOffsets.append(len(tagData))
+        with atomicWrite(cacheFile, 'wb') as f:
+            f.write(header.pack(magic, self.size, self.mtime, self.offset,
+                                self.checksum, self.journalRecords, len(self),
+                                len(self.tagNames), self.nbWords))
+            for data in (tagOffsets, tagData, self.starts, self.ends,
+                         self.masks, self.descOffsets, self.descData):
+                data = memoryview(data)
+                f.write(data)
+                f.write(b'\0' * _pad(data.nbytes))
+
+    def isPrefixOf (self, filename, size) :
+        """
+        Whether the activity file has grown and its parsed part is unchanged
+
+          The checksum of the whole parsed part is compared, so that edits
+          keeping the size of the file unchanged are detected.
+        """
+        if size <= self.offset:
+            return False
+        checksum = 0
+        remaining = self.offset
+        with open(filename, 'rb') as f:
+            while remaining > 0:
+                data = f.read(min(blockSize, remaining))
+                if not data:
+                    return False
+                checksum = zlib.crc32(data, checksum)
+                remaining -= len(data)
+        count('bytes checked', self.offset)
+        return checksum == self.checksum
+
+    def update (self, filename) :
+        """
+        Parse the lines appended to an activity file since last update
+        """
+        rows = len(self)
+        journalRecords = 0
+        end = self.offset
+        with open(filename, 'rb') as f, phase('parse'):
+            st = os.fstat(f.fileno())
+            f.seek(self.offset)
+            for chunk in lineChunks(f):
+                # Only parse complete lines
+                if not chunk.endswith(b'\n'):
+                    break
+                journalRecords += self.readBytes(chunk)
+                self.checksum = zlib.crc32(chunk, self.checksum)
+                end += len(chunk)
+        count('bytes read', end - self.offset)
+        count('rows parsed', len(self) - rows + journalRecords)
+        self.journalRecords += journalRecords
+        self.size, self.mtime = st.st_size, st.st_mtime_ns
+        self.offset = end
+
+    def toWorkSheet (self, ignorePartition = False) :
+        """
+        Build a work sheet containing the activities of the cache
+        """
+        w = WorkSheet()
+        w.journalRecords = self.journalRecords
+        for a in self:
+            w.add(a, ignorePartition)
+        return w
+
+    def toColumnarWorkSheet (self, ignorePartition = False) :
+        """
+        Build a columnar work sheet sharing the columns of the cache
+        """
+        if not ignorePartition:
+            self.checkPartition()
+        w = ColumnarWorkSheet(self.copy())
+        w.journalRecords = self.journalRecords
+        return w
+
+def _cacheFile (filename) :
+    return filename + '.cache'
+
+def loadCache (filename, cacheFile = None) :
+    """
+    Return the cache of an activity file
+
+      The cache is updated and saved if the size or modification time of the
+      activity file changed. Only a file that grew with its parsed part
+      unchanged is parsed incrementally, otherwise the cache is rebuilt.
+    """
+    if cacheFile is None:
+        cacheFile = _cacheFile(filename)
+    st = os.stat(filename)
+    try:
+        with phase('cache load'):
+            c = ActivityCache.load(cacheFile)
+    except (IOError, OSError, ValueError):
+        c = None
+    if c is not None and c.size == st.st_size and c.mtime == st.st_mtime_ns:
+        return c
+    count('cache updates')
+    if c is None or not c.isPrefixOf(filename, st.st_size):
+        c = ActivityCache()
+    c.update(filename)
+    with phase('cache save'):
+        c.save(cacheFile)
+    return c
+
+def saveCache (filename, w, cacheFile = None) :
+    """
+    Write the cache of an activity file from the work sheet it contains
+
+      To be called after writing the work sheet in the file, in order to
+      avoid parsing it again. Caches of shards are updated when read.
+      Databases have no cache.
+    """
+    if os.path.isdir(filename) or isDatabase(filename):
+        return None
+    if cacheFile is None:
+        cacheFile = _cacheFile(filename)
+    c = ActivityCache()
+    for a in w:
+        c.append(a)
+    with open(filename, 'rb') as f:
+        st = os.fstat(f.fileno())
+        for data in iter(lambda : f.read(blockSize), b''):
+            c.checksum = zlib.crc32(data, c.checksum)
+    c.size, c.mtime, c.offset = st.st_size, st.st_mtime_ns, st.st_size
+    c.save(cacheFile)
+    return c
+
+def _loadShardCaches (directory) :
+    """
+    Return the caches of the shards of a directory merged in one object
+    """
+    import shards
+    c = ActivityCache()
+    for key in shards.Manifest.load(directory).keys():
+        shard = loadCache(shards.shardFile(directory, key))
+        c.extend(shard)
+        c.journalRecords += shard.journalRecords
+    return c
+
+def readCached (filename, partition, cacheFile = None, columnar = False) :
+    """
+    Read files filename and partition through the cache of filename and
+    return the corresponding work sheet
+
+      Input:
+        - columnar: whether to return a ColumnarWorkSheet.
+      If filename is a directory of shards, each shard has its own cache.
+      Databases are read directly, see sqlite_sheet.
+    """
+    if not partition is None:
+        Activity.readPartition (partition)
+    if isDatabase(filename):
+        import sqlite_sheet
+        if columnar:
+            return sqlite_sheet.readColumnar(filename, partition)
+        return sqlite_sheet.readDatabase(filename, partition)
+    if os.path.isdir(filename):
+        c = _loadShardCaches(filename)
+    else:
+        c = loadCache(filename, cacheFile)
+    if columnar:
+        return c.toColumnarWorkSheet(partition is None)
+    return c.toWorkSheet(partition is None)
@@ -0,0 +1,718 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2010, 2011 CNRS
+# Author: Florent Lamiraux
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED
+# TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Storage of activities in columns
+
+  Starting and ending times are stored as arrays of seconds since 1970-01-01,
+  tag sets as bitmasks over a table of tags and descriptions as a table of
+  strings. Activity objects are only built when accessed.
+"""
+
+import bisect, itertools, operator, re
+import datetime as dt
+from array import array
+from activity import Activity
+from work_sheet import WorkSheet, secondsPerDay, _hours
+from instrument import phase, count
+
+epoch = dt.datetime(1970, 1, 1)
+second = dt.timedelta(seconds = 1)
+noTime = -2**63
+"""
+Value stored for activities that are not finished.
+"""
+
+def toSeconds (t) :
+    """
+    Convert a datetime object in seconds since epoch, rounded down
+    """
+    if t is None:
+        return noTime
+    return (t - epoch) // second
+
+def _ceilSeconds (t) :
+    return -((epoch - t) // second)
+
+def fromSeconds (s) :
+    if s == noTime:
+        return None
+    return epoch + dt.timedelta(0, s)
+
+_separators = b';\n'
+_notSeparators = bytes(c for c in range(256) if not c in _separators)
+_epochOrdinal = epoch.toordinal()
+_dayKey = operator.itemgetter(slice(0, 11))
+_timeKey = operator.itemgetter(slice(11, 16))
+_tailKey = operator.itemgetter(slice(16, None))
+_dayField = re.compile(rb'\d{4}-\d\d-\d\d ')
+_timeField = re.compile(rb'\d\d:\d\d')
+
+def _daySeconds (k) :
+    # seconds at midnight of "YYYY-MM-DD " as bytes
+    if _dayField.fullmatch(k):
+        try:
+            return secondsPerDay*(dt.date(int(k[:4]), int(k[5:7]),
+                                          int(k[8:10])).toordinal() -
+                                  _epochOrdinal)
+        except ValueError:
+            pass
+    return None
+
+def _timeSeconds (k) :
+    # seconds since midnight of "HH:MM" as bytes
+    if _timeField.fullmatch(k) and int(k[:2]) < 24 and int(k[3:]) < 60:
+        return 3600*int(k[:2]) + 60*int(k[3:])
+    return None
+
+def _indices (sequence, value) :
+    # positions of value in sequence
+    result = []
+    i = -1
+    try:
+        while True:
+            i = sequence.index(value, i + 1)
+            result.append(i)
+    except ValueError:
+        return result
+
+numpyThreshold = 10000
+"""
+Number of lines of a chunk above which times are parsed by numpy, if
+available
+"""
+chunkSize = 1 << 20
+"""
+Size in bytes of the chunks of lines parsed at once by
+ActivityColumns.readBytes
+"""
+_digitColumns = [0, 1, 2, 3, 5, 6, 8, 9, 11, 12, 14, 15]
+_none = list(b'None')
+
+def _parseTimeFieldsNumpy (np, buf, begins, ends) :
+    """
+    Parse the time fields buf[begins[i]:ends[i]] in seconds since epoch
+
+      Fields are checked as by _parseTimes: "None", or "YYYY-MM-DD HH:MM"
+      followed by nothing or by a colon and characters without space.
+      Return None if a field is irregular.
+    """
+    windows = np.lib.stride_tricks.sliding_window_view(buf, 16)
+    lengths = ends - begins
+    nones = lengths == 4
+    if nones.any():
+        if not (buf[begins[nones][:, None] + np.arange(4)] == _none).all():
+            return None
+        begins, lengths = begins[~nones], lengths[~nones]
+    if (lengths < 16).any():
+        return None
+    m = windows[begins]
+    d = m[:, _digitColumns]
+    if not (((d >= 48) & (d <= 57)).all() and (m[:, 4] == 45).all() and
+            (m[:, 7] == 45).all() and (m[:, 10] == 32).all() and
+            (m[:, 13] == 58).all()):
+        return None
+    # tails of fields, by length
+    for n in np.unique(lengths[lengths > 16]).tolist():
+        tails = buf[begins[lengths == n][:, None] + np.arange(16, n)]
+        if not ((tails[:, 0] == 58).all() and (tails != 32).all()):
+            return None
+    d = d.astype(np.int64) - 48
+    year = 1000*d[:, 0] + 100*d[:, 1] + 10*d[:, 2] + d[:, 3]
+    month = 10*d[:, 4] + d[:, 5]
+    day = 10*d[:, 6] + d[:, 7]
+    hour = 10*d[:, 8] + d[:, 9]
+    minute = 10*d[:, 10] + d[:, 11]
+    if (year == 0).any() or (month == 0).any() or (month > 12).any() or \
+            (day == 0).any() or (hour >= 24).any() or (minute >= 60).any():
+        return None
+    # days since epoch of the first day of the month and of the next one
+    months = 12*(year - 1970) + month - 1
+    first = months.astype('datetime64[M]').astype('datetime64[D]')\
+        .astype(np.int64)
+    nextFirst = (months + 1).astype('datetime64[M]')\
+        .astype('datetime64[D]').astype(np.int64)
+    if (first + day > nextFirst).any():
+        return None
+    result = np.full(len(nones), noTime, dtype = np.int64)
+    result[~nones] = secondsPerDay*(first + day - 1) + 3600*hour + 60*minute
+    return result
+
+def _parseTimesNumpy (data, nbLines) :
+    """
+    Parse the starting and ending times of the lines of a buffer with numpy
+
+      Lines should have four fields. Return a pair of arrays of seconds since
+      epoch, or None if numpy is not available or a time field is irregular,
+      see _parseTimes.
+    """
+    try:
+        import numpy as np
+    except ImportError:
+        return None
+    buf = np.frombuffer(data, dtype = np.uint8)
+    semicolons = np.flatnonzero(buf == 59).reshape(nbLines, 3)
+    lineBegins = np.zeros(nbLines, dtype = np.int64)
+    lineBegins[1:] = np.flatnonzero(buf == 10) + 1
+    starts = _parseTimeFieldsNumpy(np, buf, lineBegins, semicolons[:, 0])
+    if starts is None:
+        return None
+    ends = _parseTimeFieldsNumpy(np, buf, semicolons[:, 0] + 1,
+                                 semicolons[:, 1])
+    if ends is None:
+        return None
+    return array('q', starts.tobytes()), array('q', ends.tobytes())
+
+def lineChunks (f) :
+    """
+    Iterate over the content of a file opened in binary mode by chunks of
+    about chunkSize bytes ending at the end of a line
+
+      The last chunk does not end with a newline if the file does not.
+    """
+    rest = b''
+    while True:
+        block = f.read(chunkSize)
+        if not block:
+            break
+        data = rest + block
+        end = data.rfind(b'\n') + 1
+        if end > 0:
+            yield data[:end]
+        rest = data[end:]
+    if rest:
+        yield rest
+
+def _parseTimes (fields, days, times) :
+    """
+    Parse time fields as bytes in seconds since epoch
+
+      Fields of the form "YYYY-MM-DD HH:MM[:...]" are split at fixed
+      positions and distinct dates and times are only parsed once: days and
+      times are dictionaries of parsed values shared between calls. Return
+      None if a field is of another form than this one or "None", in which
+      case Activity.strToDatetime may give another result.
+    """
+    nones = _indices(fields, b'None')
+    if len(nones) > 0:
+        fields = list(fields)
+        for i in nones:
+            fields[i] = b'1970-01-01 00:00'
+    dayKeys = list(map(_dayKey, fields))
+    timeKeys = list(map(_timeKey, fields))
+    for cache, keys, parse in ((days, dayKeys, _daySeconds),
+                               (times, timeKeys, _timeSeconds)):
+        new = dict((k, parse(k)) for k in set(keys).difference(cache))
+        if None in new.values():
+            return None
+        cache.update(new)
+    # the rest of fields should be empty or seconds without space.
+    if not all(t == b'' or (t[:1] == b':' and not b' ' in t)
+               for t in set(map(_tailKey, fields))):
+        return None
+    result = list(map(operator.add, map(days.__getitem__, dayKeys),
+                      map(times.__getitem__, timeKeys)))
+    for i in nones:
+        result[i] = noTime
+    return result
+
+class ActivityColumns (object) :
+    """
+    Sequence of activities stored in columns
+
+      - starts, ends: starting and ending times in seconds since epoch,
+      - masks:        tag masks over tagNames, nbWords 64 bit words per
+                      activity,
+      - descOffsets, descData: descriptions encoded in utf-8 and
+                      concatenated.
+      Columns are arrays, or read-only memoryviews until the first
+      modification. Items are Activity objects built on access: modifying
+      them does not modify the columns, assign them instead.
+    """
+    def __init__ (self) :
+        self.nbWords = 1
+        self.tagNames = []
+        self.tagIds = {}
+        self.starts = array('q')
+        self.ends = array('q')
+        self.masks = array('Q')
+        self.descOffsets = array('q', [0])
+        self.descData = bytearray()
+        self._tagSets = {}
+        self._readOnly = False
+
+    def __len__ (self) :
+        return len(self.starts)
+
+    def copy (self) :
+        """
+        Return columns sharing the data of this object until modified
+        """
+        c = ActivityColumns()
+        c.nbWords = self.nbWords
+        c.tagNames = self.tagNames[:]
+        c.tagIds = dict(self.tagIds)
+        c.starts, c.ends, c.masks = self.starts, self.ends, self.masks
+        c.descOffsets, c.descData = self.descOffsets, self.descData
+        c._readOnly = True
+        return c
+
+    def _thaw (self) :
+        """
+        Copy read-only columns into arrays before modifying them
+        """
+        if not self._readOnly:
+            return
+        self.starts = array('q', self.starts)
+        self.ends = array('q', self.ends)
+        self.masks = array('Q', self.masks)
+        self.descOffsets = array('q', self.descOffsets)
+        self.descData = bytearray(self.descData)
+        self._readOnly = False
+
+    def tagId (self, tag) :
+        """
+        Return the index of a tag, adding it to the table if needed
+        """
+        i = self.tagIds.get(tag)
+        if i is None:
+            i = len(self.tagNames)
+            self.tagNames.append(tag)
+            self.tagIds[tag] = i
+            if i >= 64*self.nbWords:
+                self._widen(self.nbWords + 1)
+        return i
+
+    def _widen (self, nbWords) :
+        self._thaw()
+        masks = array('Q', bytes(8*nbWords*len(self)))
+        for r in range(len(self)):
+            masks[r*nbWords:r*nbWords+self.nbWords] = \
+                self.masks[r*self.nbWords:(r+1)*self.nbWords]
+        self.masks = masks
+        self.nbWords = nbWords
+
+    def mask (self, row) :
+        """
+        Return the tag mask of an activity as an integer
+        """
+        if self.nbWords == 1:
+            return self.masks[row]
+        m = 0
+        for k in range(self.nbWords - 1, -1, -1):
+            m = (m << 64) | self.masks[row*self.nbWords + k]
+        return m
+
+    def allMasks (self) :
+        """
+        Return the sequence of tag masks of all activities
+        """
+        if self.nbWords == 1:
+            return self.masks
+        return [self.mask(row) for row in range(len(self))]
+
+    def toMask (self, tags) :
+        """
+        Return the mask of a set of tags, adding them to the table if needed
+        """
+        m = 0
+        for t in tags:
+            m |= 1 << self.tagId(t)
+        return m
+
+    def tagSet (self, m) :
+        """
+        Return the frozen set of tags of a mask
+        """
+        tags = self._tagSets.get(m)
+        if tags is None:
+            tags = Activity.internTags(t for i, t in enumerate(self.tagNames)
+                                       if m >> i & 1)
+            Activity.tags.update(tags)
+            self._tagSets[m] = tags
+        return tags
+
+    def _activity (self, row) :
+        a = Activity.__new__(Activity)
+        a.startTime = epoch + dt.timedelta(0, self.starts[row])
+        end = self.ends[row]
+        a.endTime = None if end == noTime else epoch + dt.timedelta(0, end)
+        a.description = str(self.descData[self.descOffsets[row]:
+                                          self.descOffsets[row+1]], 'utf-8')
+        a.instanceTags = self.tagSet(self.mask(row))
+        return a
+
+    def __getitem__ (self, key) :
+        if isinstance(key, slice):
+            return [self._activity(row)
+                    for row in range(*key.indices(len(self)))]
+        if key < 0:
+            key += len(self)
+        if not 0 <= key < len(self):
+            raise IndexError("activity index out of range")
+        return self._activity(key)
+
+    def __iter__ (self) :
+        for row in range(len(self)):
+            yield self._activity(row)
+
+    def __add__ (self, other) :
+        return list(self) + list(other)
+
+    def extend (self, other) :
+        """
+        Append the activities of other columns
+
+          Tag masks are translated to the tag table of this object once per
+          distinct mask.
+        """
+        self._thaw()
+        ids = [self.tagId(t) for t in other.tagNames]
+        translation = {}
+        def translate (m) :
+            result = translation.get(m)
+            if result is None:
+                result = 0
+                for i, j in enumerate(ids):
+                    if m >> i & 1:
+                        result |= 1 << j
+                translation[m] = result
+            return result
+        masks = map(translate, other.allMasks())
+        if self.nbWords == 1:
+            self.masks.extend(masks)
+        else:
+            for m in masks:
+                for k in range(self.nbWords):
+                    self.masks.append((m >> (64*k)) & 0xffffffffffffffff)
+        self.starts.extend(other.starts)
+        self.ends.extend(other.ends)
+        offset = len(self.descData)
+        self.descOffsets.extend(o + offset for o in other.descOffsets[1:])
+        self.descData += other.descData
+
+    def append (self, activity) :
+        self._thaw()
+        m = self.toMask(activity.instanceTags)
+        self.starts.append(toSeconds(activity.startTime))
+        self.ends.append(toSeconds(activity.endTime))
+        for k in range(self.nbWords):
+            self.masks.append((m >> (64*k)) & 0xffffffffffffffff)
+        self.descData += activity.description.encode('utf-8')
+        self.descOffsets.append(len(self.descData))
+
+    def readLines (self, lines) :
+        """
+        Append activities read from lines of an activity file
+
+          Lines are bytes or str objects. See readBytes.
+        """
+        return self.readBytes(b'\n'.join(
+                (line.encode() if isinstance(line, str) else line)
+                .rstrip(b'\r\n') for line in lines))
+
+    def readBytes (self, data, useNumpy = True) :
+        """
+        Append activities read from the content of an activity file
+
+          Content is parsed by chunks of lines of about chunkSize bytes, so
+          that only the fields of one chunk are in memory at once. Fields of
+          a chunk are parsed column by column, without building Activity
+          objects, if all lines have four fields and all times are of the
+          form "YYYY-MM-DD HH:MM[:...]", and line by line by
+          Activity.fromLine otherwise. Times of chunks of more than
+          numpyThreshold lines are parsed with numpy if available and
+          useNumpy is true, see _parseTimesNumpy. As in WorkSheet.addRecord,
+          an activity starting at the same time as the last activity, if
+          open, replaces it. Return the number of such closing records.
+        """
+        self._thaw()
+        journalRecords = 0
+        begin = 0
+        while begin < len(data):
+            end = data.find(b'\n', begin + chunkSize) + 1 or len(data)
+            journalRecords += self._readChunk(data[begin:end], useNumpy)
+            begin = end
+        return journalRecords
+
+    def readFile (self, f, useNumpy = True) :
+        """
+        Append activities read from a file opened in binary mode
+
+          The file is read by chunks, see lineChunks and readBytes.
+        """
+        self._thaw()
+        return sum(self.readBytes(chunk, useNumpy)
+                   for chunk in lineChunks(f))
+
+    def _readChunk (self, data, useNumpy) :
+        if data.endswith(b'\n'):
+            data = data[:-1]
+        if len(data) == 0:
+            return 0
+        nbLines = data.count(b'\n') + 1
+        if data.translate(None, _notSeparators) != \
+                b'\n'.join([b';;;']*nbLines):
+            # some lines do not have four fields
+            return self._readActivities(Activity.fromLine(line)
+                                        for line in data.split(b'\n'))
+        fields = data.replace(b'\n', b';').split(b';')
+        columns = None
+        if useNumpy and nbLines >= numpyThreshold:
+            columns = _parseTimesNumpy(data, nbLines)
+        if columns is None:
+            days, times = {}, {}
+            columns = (_parseTimes(fields[0::4], days, times),
+                       _parseTimes(fields[1::4], days, times))
+        starts, ends = columns
+        if starts is None or ends is None:
+            return self._readActivities(Activity.fromLine(line)
+                                        for line in data.split(b'\n'))
+        descriptions = fields[2::4]
+        tagFields = fields[3::4]
+        tagMasks = {}
+        for field in set(tagFields):
+            tags = Activity.internTags(t.strip('"') for t in field.decode()
+                                       .rstrip('\r').split('" "'))
+            Activity.tags.update(tags)
+            tagMasks[field] = self.toMask(tags)
+        masks = list(map(tagMasks.__getitem__, tagFields))
+        # Closing records replace the previous open activity.
+        journalRecords = 0
+        if len(self) > 0 and self.ends[-1] == noTime and \
+                self.starts[-1] == starts[0]:
+            self.pop()
+            journalRecords += 1
+        n = len(starts)
+        closed = [i for i in _indices(ends, noTime)
+                  if i + 1 < n and starts[i+1] == starts[i]]
+        if len(closed) > 0:
+            journalRecords += len(closed)
+            closed = set(closed)
+            keep = [i for i in range(n) if not i in closed]
+            starts = [starts[i] for i in keep]
+            ends = [ends[i] for i in keep]
+            descriptions = [descriptions[i] for i in keep]
+            masks = [masks[i] for i in keep]
+        self.starts.extend(starts)
+        self.ends.extend(ends)
+        if self.nbWords == 1:
+            self.masks.extend(masks)
+        else:
+            for m in masks:
+                for k in range(self.nbWords):
+                    self.masks.append((m >> (64*k)) & 0xffffffffffffffff)
+        self.descOffsets.extend(itertools.islice(itertools.accumulate(
+                    map(len, descriptions), initial = len(self.descData)),
+                                                 1, None))
+        self.descData += b''.join(descriptions)
+        return journalRecords
+
+    def _readActivities (self, activities) :
+        journalRecords = 0
+        for a in activities:
+            if len(self) > 0 and self.ends[-1] == noTime and \
+                    self.starts[-1] == toSeconds(a.startTime):
+                self.pop()
+                journalRecords += 1
+            self.append(a)
+        return journalRecords
+
+    def pop (self) :
+        """
+        Remove and return the last activity
+        """
+        if len(self) == 0:
+            raise IndexError("pop from empty activity columns")
+        a = self[-1]
+        self._thaw()
+        n = len(self) - 1
+        del self.starts[n]
+        del self.ends[n]
+        del self.masks[n*self.nbWords:]
+        del self.descOffsets[n+1]
+        del self.descData[self.descOffsets[n]:]
+        return a
+
+    def __setitem__ (self, row, activity) :
+        if row < 0:
+            row += len(self)
+        if not 0 <= row < len(self):
+            raise IndexError("activity index out of range")
+        self._thaw()
+        m = self.toMask(activity.instanceTags)
+        self.starts[row] = toSeconds(activity.startTime)
+        self.ends[row] = toSeconds(activity.endTime)
+        for k in range(self.nbWords):
+            self.masks[row*self.nbWords+k] = (m >> (64*k)) & 0xffffffffffffffff
+        description = activity.description.encode('utf-8')
+        begin, end = self.descOffsets[row], self.descOffsets[row+1]
+        self.descData[begin:end] = description
+        shift = len(description) - (end - begin)
+        if shift != 0:
+            for i in range(row + 1, len(self.descOffsets)):
+                self.descOffsets[i] += shift
+
+    def sort (self) :
+        """
+        Sort activities by starting time
+        """
+        order = sorted(range(len(self)), key = self.starts.__getitem__)
+        if all(i == r for i, r in enumerate(order)):
+            return
+        self._thaw()
+        W = self.nbWords
+        descData = bytearray()
+        descOffsets = array('q', [0])
+        for row in order:
+            descData += self.descData[self.descOffsets[row]:
+                                      self.descOffsets[row+1]]
+            descOffsets.append(len(descData))
+        self.starts = array('q', (self.starts[row] for row in order))
+        self.ends = array('q', (self.ends[row] for row in order))
+        self.masks = array('Q', (self.masks[row*W+k] for row in order
+                                 for k in range(W)))
+        self.descOffsets, self.descData = descOffsets, descData
+
+    def checkPartition (self) :
+        """
+        Check that each activity contains one and only one element of the
+        partition
+        """
+        count('partition checks', len(self))
+        p = self.toMask(t for t in Activity.partition if t in self.tagIds)
+        with phase('partition check'):
+            for m in self.allMasks():
+                m &= p
+                if m == 0 or m & (m - 1) != 0:
+                    raise RuntimeError ("activity should contain one and " +
+                                        "only one element of partition.")
+
+class ColumnarWorkSheet (WorkSheet) :
+    """
+    Work sheet storing activities in columns
+
+      Memory footprint is a few tens of bytes per activity. Total times and
+      time range extraction are computed on the columns. Activities returned
+      by indexing or iteration are copies: assign them to modify the work
+      sheet.
+    """
+    def __init__ (self, columns = None) :
+        WorkSheet.__init__(self)
+        if columns is None:
+            columns = ActivityColumns()
+        self.activities = columns
+        self._resetIndex()
+
+    def _resetIndex (self) :
+        WorkSheet._resetIndex(self)
+        self._checkedOrder = 0
+
+    def read (self, filename, ignorePartition = False) :
+        """
+        Read a work sheet in a file
+        """
+        with phase('read'), open(filename, 'rb') as f :
+            self._parse(self.activities.readFile, f)
+            count('bytes read', f.tell())
+        if not ignorePartition:
+            self.activities.checkPartition()
+
+    def readLines (self, lines, ignorePartition = False) :
+        """
+        Read a work sheet from an iterable over lines of text or bytes
+        """
+        self._parse(self.activities.readLines, lines)
+        if not ignorePartition:
+            self.activities.checkPartition()
+
+    def _parse (self, parse, content) :
+        rows = len(self.activities)
+        with phase('parse'):
+            journalRecords = parse(content)
+        count('rows parsed', len(self.activities) - rows + journalRecords)
+        self.journalRecords += journalRecords
+
+    def sort (self) :
+        self.activities.sort()
+        self._resetIndex()
+
+    def isSorted (self) :
+        """
+        Whether activities are sorted by starting time
+        """
+        self._checkIndex()
+        starts = self.activities.starts
+        for i in range(max(1, self._checkedOrder), len(starts)):
+            if starts[i] < starts[i-1]:
+                self._sorted = False
+                break
+        self._checkedOrder = len(starts)
+        return self._sorted
+
+    def extractBetween (self, start, end) :
+        """
+        Extract activities starting between two datetime objects
+        """
+        if not self.isSorted():
+            return WorkSheet.extractBetween(self, start, end)
+        starts = self.activities.starts
+        lo = bisect.bisect_left(starts, _ceilSeconds(start))
+        hi = bisect.bisect_right(starts, toSeconds(end))
+        w = WorkSheet()
+        w.activities = self.activities[lo:hi]
+        return w
+
+    @property
+    def totalTime (self) :
+        """
+        Return total time in hours
+        """
+        c = self.activities
+        seconds = 0
+        for s, e in zip(c.starts, c.ends):
+            if e != noTime:
+                seconds += e - s
+        return _hours(dt.timedelta(0, seconds))
+
+    def totalTimeByTag (self) :
+        """
+        Return a dictionary giving the total time in hours for each tag
+        """
+        c = self.activities
+        byMask = {}
+        for s, e, m in zip(c.starts, c.ends, c.allMasks()):
+            byMask[m] = byMask.get(m, 0) + (0 if e == noTime else e - s)
+        seconds = {}
+        for m, d in byMask.items():
+            for t in c.tagSet(m):
+                seconds[t] = seconds.get(t, 0) + d
+        return dict((t, _hours(dt.timedelta(0, d)))
+                    for t, d in seconds.items())
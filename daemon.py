@@ -0,0 +1,380 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2010, 2011 CNRS
+# Author: Florent Lamiraux
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED
+# TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Activity daemon
+
+  Keeps the work sheet of ~/.activity in memory and serves requests on the
+  Unix domain socket ~/.activity.sock, so that toggling activities does not
+  read the activity file. Activities are appended to the file shortly after
+  the answer (write-behind), and in any case before the daemon exits.
+
+  Usage:
+    python daemon.py serve
+    python daemon.py start [--new] description tag [tag ...]
+    python daemon.py stop
+    python daemon.py switch [[--new] description tag [tag ...]]
+    python daemon.py status
+    python daemon.py statistics
+    python daemon.py shutdown
+
+  Requests and answers are JSON objects, one per line. A request contains a
+  "command" and, for start and switch, a "description" and a list of
+  "tags". Tags unknown so far are refused unless listed in "newTags". An
+  answer contains either an "error" message or the result of the command.
+  Option --new confirms the tags unknown so far.
+"""
+
+import os, sys, json, socket
+import datetime as dt
+from activity import Activity, TagError
+# Other modules are imported by the daemon only, so that clients start fast.
+
+filename = os.getenv('HOME')+"/.activity"
+partition = os.getenv('HOME')+"/.activity-partition"
+socketFile = filename + ".sock"
+
+flushDelay = .5
+"""
+Delay in seconds between a modification and its writing in the activity file
+"""
+
+class ActivityServer (object) :
+    """
+    Work sheet of an activity file served on a Unix domain socket
+    """
+    def __init__ (self, filename, partition, socketFile) :
+        self.filename = filename
+        self.partition = partition
+        self.socketFile = socketFile
+        self.pending = []
+        self._flushTask = None
+        self._stat = None
+        self.load()
+
+    def load (self) :
+        """
+        Read the activity file
+        """
+        from cache import readCached
+        self.w = readCached(self.filename, self.partition, columnar = True)
+        Activity.tags.update (self.w.activities.tagNames)
+        Activity.tags.update (Activity.partition)
+        self._stat = self._fileStat()
+
+    def _fileStat (self) :
+        from work_sheet import fileStamp
+        return fileStamp(self.filename)
+
+    def _checkFile (self) :
+        # the file may have been modified by another program
+        if len(self.pending) == 0 and self._fileStat() != self._stat:
+            self.load()
+
+    def flush (self) :
+        """
+        Append pending activities to the activity file
+
+          Pending activities were recorded on the file as last read or
+          written. If another program modified it since, it is read again
+          and pending activities are recorded again, see _replay.
+        """
+        from rollup import appendActivities
+        from work_sheet import ConcurrentModification
+        while len(self.pending) > 0:
+            try:
+                self._stat = appendActivities(self.filename, self.pending,
+                                              stamp = self._stat)
+                self.pending = []
+            except ConcurrentModification:
+                pending = self.pending
+                self.pending = []
+                self.load()
+                self._replay(pending)
+
+    async def _flushLater (self) :
+        import asyncio
+        await asyncio.sleep(flushDelay)
+        self._flushTask = None
+        self.flush()
+
+    def _keep (self, activity) :
+        # keep in memory the activity as it will be read from the file
+        a = Activity()
+        a.startTime = Activity.toMinute(activity.startTime)
+        a.endTime = activity.endTime and Activity.toMinute(activity.endTime)
+        a.description = activity.description
+        a.instanceTags = activity.instanceTags
+        self.w.addRecord(a)
+        self.pending.append(activity)
+
+    def _record (self, activity) :
+        import asyncio
+        self._keep(activity)
+        if self._flushTask is None:
+            self._flushTask = asyncio.ensure_future(self._flushLater())
+
+    def _replay (self, records) :
+        """
+        Record again activities recorded before the activity file was
+        modified by another program
+
+          Closing records are kept if they finish the current activity of
+          the file, new activities if none is in progress. Other records are
+          dropped with a message.
+        """
+        for a in records:
+            current = self._current()
+            if a.endTime is None:
+                valid = current is None
+            else:
+                valid = current is not None and \
+                    current.startTime == Activity.toMinute(a.startTime)
+            if valid:
+                self._keep(a)
+            else:
+                print ("%s modified meanwhile, dropped: %s" %
+                       (self.filename, a), file = sys.stderr)
+
+    def _current (self) :
+        if len(self.w) > 0 and self.w[-1].endTime is None:
+            return self.w[-1]
+        return None
+
+    def _close (self, now) :
+        current = self._current()
+        if current is None:
+            return None
+        a = Activity()
+        a.startTime = current.startTime
+        a.endTime = now
+        a.description = current.description
+        a.instanceTags = current.instanceTags
+        self._record(a)
+        return a
+
+    def _newActivity (self, now, description, tags, newTags) :
+        a = Activity()
+        a.startTime = now
+        a.description = description
+        for t in tags:
+            if t in newTags:
+                a.addNewTag(t)
+            else:
+                a.addTag(t)
+        if not a.inPartition():
+            raise RuntimeError ("activity should contain one and only one " +
+                                "element of partition.")
+        return a
+
+    def status (self, request) :
+        current = self._current()
+        if current is None:
+            return {'current': None}
+        return {'current': _activityToDict(current)}
+
+    def start (self, request) :
+        if self._current() is not None:
+            raise RuntimeError("activity %s is not finished." %
+                               self._current().description)
+        a = self._newActivity(dt.datetime.now(), request['description'],
+                              request['tags'], request.get('newTags', []))
+        self._record(a)
+        return {'started': _activityToDict(a)}
+
+    def stop (self, request) :
+        a = self._close(dt.datetime.now())
+        if a is None:
+            raise RuntimeError("no activity in progress.")
+        return {'finished': _activityToDict(a)}
+
+    def switch (self, request) :
+        """
+        Finish the current activity and start a new one, or resume the last
+        activity if none is in progress and no description is given
+        """
+        now = dt.datetime.now()
+        if 'description' in request:
+            description, tags = request['description'], request['tags']
+        elif self._current() is None and len(self.w) > 0:
+            description, tags = self.w[-1].description, self.w[-1].instanceTags
+        else:
+            raise RuntimeError("no description for the new activity.")
+        aNew = self._newActivity(now, description, tags,
+                                 request.get('newTags', []))
+        result = {}
+        aOld = self._close(now)
+        if aOld is not None:
+            result['finished'] = _activityToDict(aOld)
+        self._record(aNew)
+        result['started'] = _activityToDict(aNew)
+        return result
+
+    def statistics (self, request) :
+        from aggregate import timeByPartition
+        w = self.w
+        return {'total': w.totalTime,
+                'partition': timeByPartition(w),
+                'today': w.extractToday().totalTime,
+                'week': w.extractThisWeek().totalTime}
+
+    commands = ('status', 'start', 'stop', 'switch', 'statistics')
+
+    def handle (self, request) :
+        """
+        Return the answer to a request
+        """
+        command = request.get('command')
+        if not command in self.commands:
+            return {'error': "unknown command %r." % command}
+        try:
+            self._checkFile()
+            return getattr(self, command)(request)
+        except (KeyError, TagError, RuntimeError, ValueError) as exc:
+            return {'error': str(exc)}
+
+    async def _serveClient (self, reader, writer) :
+        try:
+            line = await reader.readline()
+            try:
+                request = json.loads(line)
+            except ValueError:
+                answer = {'error': "invalid request."}
+            else:
+                if request.get('command') == 'shutdown':
+                    self._server.close()
+                    answer = {'shutdown': True}
+                else:
+                    answer = self.handle(request)
+            writer.write(json.dumps(answer).encode() + b'\n')
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def serve (self) :
+        """
+        Serve requests until a shutdown request
+        """
+        import asyncio
+        self._server = await asyncio.start_unix_server(self._serveClient,
+                                                       path = self.socketFile)
+        try:
+            await self._server.wait_closed()
+        finally:
+            if self._flushTask is not None:
+                self._flushTask.cancel()
+            self.flush()
+            os.remove(self.socketFile)
+
+def _activityToDict (a) :
+    return {'start': str(a.startTime),
+            'end': None if a.endTime is None else str(a.endTime),
+            'description': a.description,
+            'tags': sorted(a.instanceTags)}
+
+def request (command, socketFile = socketFile, **kwds) :
+    """
+    Send a request to the daemon and return the answer
+
+      Raise socket.error if the daemon does not run.
+    """
+    kwds['command'] = command
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        s.connect(socketFile)
+        s.sendall(json.dumps(kwds).encode() + b'\n')
+        data = b''
+        while not data.endswith(b'\n'):
+            chunk = s.recv(4096)
+            if not chunk:
+                break
+            data += chunk
+    finally:
+        s.close()
+    return json.loads(data)
+
+def serve () :
+    """
+    Run the daemon, unless another one answers on the socket
+    """
+    import asyncio
+    if os.path.exists(socketFile):
+        try:
+            request('status')
+            raise RuntimeError("daemon already running on %s." % socketFile)
+        except (OSError, ValueError):
+            # left by a daemon that did not exit normally
+            os.remove(socketFile)
+    server = ActivityServer(filename, partition, socketFile)
+    asyncio.run(server.serve())
+
+def _display (answer) :
+    if 'error' in answer:
+        print ("Error: %s" % answer['error'])
+        return
+    for key in ('finished', 'started', 'current'):
+        if key in answer:
+            a = answer[key]
+            print ("%s: %s" % (key.capitalize(), a['description']
+                               if a is not None else None))
+    if 'total' in answer:
+        total = answer['total']
+        print ("Total time: %f" % total)
+        for p, t in answer['partition'].items():
+            print ("  " + p + ":" + (30 - len (p))*" " + "\t" + "%.2f"%t +
+                   "\t" + "%.2f"%(t/total*100) + "%")
+        print ("")
+        print ("Today: %f" % answer['today'])
+        print ("This week: %f" % answer['week'])
+
+if __name__ == '__main__':
+    from instrument import parseOptions
+    sys.argv[1:] = parseOptions(sys.argv[1:])
+    if len(sys.argv) < 2:
+        print (__doc__)
+        sys.exit(1)
+    command = sys.argv[1]
+    if command == 'serve':
+        serve()
+        sys.exit(0)
+    kwds = {}
+    args = sys.argv[2:]
+    newTags = len(args) > 0 and args[0] == '--new'
+    if newTags:
+        args.pop(0)
+    if len(args) > 0:
+        kwds['description'] = args[0]
+        kwds['tags'] = args[1:]
+        if newTags:
+            kwds['newTags'] = args[1:]
+    answer = request(command, **kwds)
+    _display(answer)
+    if 'error' in answer:
+        sys.exit(1)
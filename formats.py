@@ -0,0 +1,357 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2010, 2011 CNRS
+# Author: Florent Lamiraux
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED
+# TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Storage formats of activities
+
+  Usage: python formats.py convert [--from format] [--to format]
+                                   input output
+
+  Activities are read and written one by one in the following formats:
+    - text:   the ';' separated lines of activity files,
+    - jsonl:  one JSON object per line with members start, end,
+              description and tags, times written as in text files,
+    - binary: packed records, see writeBinary,
+    - sqlite: a SQLite database, see sqliteSchema.
+  The format of an input file is detected from its first bytes, the format
+  of an output file from its extension (.jsonl, .wlb, .sqlite or .db), text
+  otherwise. Output files are replaced atomically, see work_sheet.atomicWrite.
+  Conversions between formats keep activities unchanged.
+"""
+
+import os, sys, json, struct, argparse
+from activity import Activity
+from columnar import toSeconds, fromSeconds
+from instrument import phase, count
+
+binaryMagic = b'WLB1'
+_tagHeader = struct.Struct('<H')
+_record = struct.Struct('<qqHH')
+
+sqliteMagic = b'SQLite format 3\0'
+sqliteSchema = """
+CREATE TABLE IF NOT EXISTS activities (
+    id INTEGER PRIMARY KEY,
+    start INTEGER NOT NULL,
+    end INTEGER,
+    description TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS tags (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE);
+CREATE TABLE IF NOT EXISTS activity_tags (
+    activity INTEGER NOT NULL REFERENCES activities(id),
+    tag INTEGER NOT NULL REFERENCES tags(id),
+    PRIMARY KEY (activity, tag));
+CREATE INDEX IF NOT EXISTS activities_start ON activities(start);
+CREATE INDEX IF NOT EXISTS activity_tags_tag ON activity_tags(tag, activity);
+"""
+"""
+Schema of SQLite databases of activities
+
+  Times are stored in seconds since 1970-01-01, the ending time of
+  unfinished activities is NULL. Activities are ordered by id.
+"""
+
+def _activity (start, end, description, tags) :
+    a = Activity.__new__(Activity)
+    a.startTime = start
+    a.endTime = end
+    a.description = description
+    a.instanceTags = Activity.internTags(tags)
+    Activity.tags.update(a.instanceTags)
+    return a
+
+def readText (filename) :
+    from work_sheet import iterActivities
+    return iterActivities(filename)
+
+def writeText (f, activities) :
+    from work_sheet import writeText
+    return writeText(f, activities)
+
+def readJsonLines (filename) :
+    """
+    Iterate over the activities of a JSON Lines file
+    """
+    with open(filename, 'r') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            d = json.loads(line)
+            end = d['end']
+            yield _activity(Activity.strToDatetime(d['start']),
+                            None if end is None else
+                            Activity.strToDatetime(end),
+                            d['description'], d['tags'])
+
+def writeJsonLines (f, activities) :
+    """
+    Write activities in JSON Lines, one object per line
+    """
+    from work_sheet import batchSize
+    batch = []
+    for a in activities:
+        batch.append(json.dumps({
+                    'start': str(a.startTime),
+                    'end': None if a.endTime is None else str(a.endTime),
+                    'description': a.description,
+                    'tags': sorted(a.instanceTags)}, ensure_ascii = False))
+        if len(batch) == batchSize:
+            batch.append('')
+            f.write('\n'.join(batch))
+            batch = []
+    if len(batch) > 0:
+        batch.append('')
+        f.write('\n'.join(batch))
+
+def readBinary (filename) :
+    """
+    Iterate over the activities of a binary file, see writeBinary
+    """
+    tags = []
+    with open(filename, 'rb') as f:
+        if f.read(len(binaryMagic)) != binaryMagic:
+            raise IOError("%s is not a binary activity file." % filename)
+        while True:
+            kind = f.read(1)
+            if kind == b'':
+                return
+            if kind == b'T':
+                length, = _tagHeader.unpack(f.read(_tagHeader.size))
+                tags.append(sys.intern(str(f.read(length), 'utf-8')))
+            elif kind == b'A':
+                data = f.read(_record.size)
+                if len(data) < _record.size:
+                    raise IOError("%s: truncated record." % filename)
+                start, end, nbTags, length = _record.unpack(data)
+                ids = struct.unpack('<%dH' % nbTags, f.read(2*nbTags))
+                description = str(f.read(length), 'utf-8')
+                yield _activity(fromSeconds(start), fromSeconds(end),
+                                description, [tags[i] for i in ids])
+            else:
+                raise IOError("%s: unknown record %r." % (filename, kind))
+
+def writeBinary (f, activities) :
+    """
+    Write activities in packed binary records
+
+      The file starts with binaryMagic, followed by two kinds of records:
+        - b'T', the length of a tag as a 16 bit integer and the tag in
+          UTF-8, defining the tag of next identifier, from 0 on,
+        - b'A', starting and ending times in seconds since 1970-01-01 as
+          64 bit integers, the latter being -2**63 for unfinished
+          activities, the number of tags and the length of the description
+          as 16 bit integers, the identifiers of the tags as 16 bit integers
+          and the description in UTF-8.
+      Integers are little-endian. A tag is defined before the first activity
+      it belongs to, so that files are written and read in one pass.
+    """
+    tagIds = {}
+    buffer = bytearray(binaryMagic)
+    for a in activities:
+        ids = []
+        for t in sorted(a.instanceTags):
+            i = tagIds.get(t)
+            if i is None:
+                i = len(tagIds)
+                tagIds[t] = i
+                name = t.encode('utf-8')
+                buffer += b'T'
+                buffer += _tagHeader.pack(len(name))
+                buffer += name
+            ids.append(i)
+        description = a.description.encode('utf-8')
+        buffer += b'A'
+        buffer += _record.pack(toSeconds(a.startTime), toSeconds(a.endTime),
+                               len(ids), len(description))
+        buffer += struct.pack('<%dH' % len(ids), *ids)
+        buffer += description
+        if len(buffer) >= 1 << 16:
+            f.write(buffer)
+            buffer = bytearray()
+    f.write(buffer)
+
+def readSqlite (filename) :
+    """
+    Iterate over the activities of a SQLite database, see sqliteSchema
+    """
+    from sqlite_sheet import iterDatabase
+    for a in iterDatabase(filename):
+        Activity.tags.update(a.instanceTags)
+        yield a
+
+def toMinutes (t) :
+    """
+    Return a datetime object in seconds since epoch, rounded down to the
+    minute as when activity files are read, None for None
+    """
+    if t is None:
+        return None
+    return toSeconds(t) // 60 * 60
+
+def insertActivities (db, activities) :
+    """
+    Insert activities in a SQLite database
+
+      Input:
+        - db: a sqlite3 connection to a database with sqliteSchema.
+      Times are rounded down to the minute, see toMinutes. Return the number
+      of activities inserted. The caller commits.
+    """
+    tagIds = dict((name, i) for i, name in
+                  db.execute('SELECT id, name FROM tags'))
+    n = 0
+    for a in activities:
+        cursor = db.execute('INSERT INTO activities (start, end, description)'
+                            ' VALUES (?, ?, ?)',
+                            (toMinutes(a.startTime), toMinutes(a.endTime),
+                             a.description))
+        for t in a.instanceTags:
+            i = tagIds.get(t)
+            if i is None:
+                i = db.execute('INSERT INTO tags (name) VALUES (?)',
+                               (t,)).lastrowid
+                tagIds[t] = i
+            db.execute('INSERT INTO activity_tags (activity, tag) '
+                       'VALUES (?, ?)', (cursor.lastrowid, i))
+        n += 1
+    return n
+
+def writeSqlite (filename, activities) :
+    """
+    Write activities in a new SQLite database, in one transaction
+    """
+    import sqlite3
+    db = sqlite3.connect(filename)
+    try:
+        db.executescript(sqliteSchema)
+        with db:
+            insertActivities(db, activities)
+    finally:
+        db.close()
+
+formats = {
+    'text': (readText, writeText, 'w'),
+    'jsonl': (readJsonLines, writeJsonLines, 'w'),
+    'binary': (readBinary, writeBinary, 'wb'),
+    'sqlite': (readSqlite, writeSqlite, None),
+    }
+"""
+Reader and writer of each format, and mode in which the writer opens files,
+None for writers opening files themselves
+"""
+
+extensions = {'.jsonl': 'jsonl', '.wlb': 'binary', '.sqlite': 'sqlite',
+              '.db': 'sqlite'}
+
+def detectFormat (filename) :
+    """
+    Return the format of an existing file from its first bytes
+    """
+    if filename == '-' or os.path.isdir(filename):
+        return 'text'
+    with open(filename, 'rb') as f:
+        head = f.read(len(sqliteMagic))
+    if head.startswith(sqliteMagic):
+        return 'sqlite'
+    if head.startswith(binaryMagic):
+        return 'binary'
+    if head.startswith(b'{'):
+        return 'jsonl'
+    return 'text'
+
+def formatOf (filename) :
+    """
+    Return the format of a file to write from its extension
+    """
+    return extensions.get(os.path.splitext(filename)[1], 'text')
+
+def readActivities (filename, format = None) :
+    """
+    Iterate over the activities of a file
+
+      Input:
+        - format: the format of the file, detected if None.
+    """
+    if format is None:
+        format = detectFormat(filename)
+    return formats[format][0](filename)
+
+def writeActivities (filename, activities, format = None) :
+    """
+    Write activities in a file
+
+      Input:
+        - format: the format of the file, given by its extension if None.
+      The file is written with work_sheet.atomicWrite. Return the number of
+      activities written.
+    """
+    if format is None:
+        format = formatOf(filename)
+    reader, writer, mode = formats[format]
+    n = [0]
+    def counted(activities) :
+        for a in activities:
+            n[0] += 1
+            yield a
+    from work_sheet import atomicWrite
+    with atomicWrite(filename, mode) as f, phase('write'):
+        writer(f, counted(activities))
+    count('activities written', n[0])
+    return n[0]
+
+def convert (source, destination, sourceFormat = None,
+             destinationFormat = None) :
+    """
+    Convert an activity file to another format
+
+      Return the number of activities converted.
+    """
+    return writeActivities(destination,
+                           readActivities(source, sourceFormat),
+                           destinationFormat)
+
+if __name__ == '__main__':
+    from instrument import parseOptions
+    sys.argv[1:] = parseOptions(sys.argv[1:])
+    parser = argparse.ArgumentParser(description = "Activity file formats")
+    commands = parser.add_subparsers(dest = 'command')
+    c = commands.add_parser('convert', help = "convert an activity file")
+    c.add_argument('input', help = "input file, '-' for standard input")
+    c.add_argument('output', help = "output file")
+    c.add_argument('--from', dest = 'source', choices = sorted(formats),
+                   default = None, help = "format of the input file")
+    c.add_argument('--to', dest = 'destination', choices = sorted(formats),
+                   default = None, help = "format of the output file")
+    args = parser.parse_args()
+    if args.command != 'convert':
+        print (__doc__)
+        sys.exit(1)
+    n = convert(args.input, args.output, args.source, args.destination)
+    print ("%d activities written." % n, file = sys.stderr)
@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2010, 2011 CNRS
+# Author: Florent Lamiraux
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED
+# TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Instrumentation of the hot paths
+
+  Phases of reading, parsing, writing and querying activity files are timed
+  and counters (rows parsed, bytes read, extract scans...) are incremented
+  when instrumentation is enabled, either by
+
+    - environment variable WORK_LOGGING_PROFILE set to 1, or
+    - option --profile of any script, given before its positional
+      arguments, see parseOptions.
+
+  A breakdown of the phases is then printed on the standard error at exit.
+  Phase times include the time of nested phases. Setting the environment
+  variable to a file name, or giving option --profile=file, also runs
+  cProfile and writes its statistics in the file, to be read by pstats.
+
+  When disabled, phase returns a shared empty context and count returns
+  immediately: instrumented code only pays a function call per phase, not
+  per row.
+"""
+
+import os, sys, time, atexit
+
+enabled = False
+counters = {}
+"""
+Value of each counter
+"""
+phases = {}
+"""
+Number of calls and total time in seconds of each phase
+"""
+_profiler = None
+_profileFile = None
+
+class _Phase (object) :
+    __slots__ = ('name', 'start')
+    def __init__ (self, name) :
+        self.name = name
+
+    def __enter__ (self) :
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__ (self, *args) :
+        p = phases.get(self.name)
+        if p is None:
+            p = phases[self.name] = [0, 0.]
+        p[0] += 1
+        p[1] += time.perf_counter() - self.start
+        return False
+
+class _NoPhase (object) :
+    __slots__ = ()
+    def __enter__ (self) :
+        return self
+
+    def __exit__ (self, *args) :
+        return False
+
+_noPhase = _NoPhase()
+
+def phase (name) :
+    """
+    Return a context timing a phase
+
+      Usage: with phase('read'): ...
+    """
+    if enabled:
+        return _Phase(name)
+    return _noPhase
+
+def count (name, n = 1) :
+    """
+    Increment a counter
+    """
+    if enabled:
+        counters[name] = counters.get(name, 0) + n
+
+def report (f = None) :
+    """
+    Print phases and counters
+    """
+    if f is None:
+        f = sys.stderr
+    f.write("Phase                          calls    time (s)\n")
+    for name, (calls, seconds) in sorted(phases.items(),
+                                         key = lambda x : -x[1][1]):
+        f.write("%-30s %6d %11.6f\n" % (name, calls, seconds))
+    if counters:
+        f.write("Counter                        value\n")
+        for name, value in sorted(counters.items()):
+            f.write("%-30s %d\n" % (name, value))
+
+def _atExit () :
+    if _profiler is not None:
+        _profiler.disable()
+        _profiler.dump_stats(_profileFile)
+        sys.stderr.write("cProfile statistics written in %s\n" %
+                         _profileFile)
+    report()
+
+def enable (profileFile = None) :
+    """
+    Enable instrumentation and print the report at exit
+
+      Input:
+        - profileFile: if not None, also run cProfile and write its
+          statistics in this file.
+    """
+    global enabled, _profiler, _profileFile
+    if not enabled:
+        atexit.register(_atExit)
+    enabled = True
+    if profileFile is not None and _profiler is None:
+        import cProfile
+        _profileFile = profileFile
+        _profiler = cProfile.Profile()
+        _profiler.enable()
+
+def configure (value = None) :
+    """
+    Enable instrumentation as requested by the value of option --profile
+
+      Input:
+        - value: '1' to enable instrumentation, a file name to also run
+          cProfile, '' or '0' to leave it disabled. If None, the value of
+          environment variable WORK_LOGGING_PROFILE is used.
+    """
+    if value is None:
+        value = os.getenv('WORK_LOGGING_PROFILE', '')
+    if value in ('', '0'):
+        return
+    enable(None if value == '1' else value)
+
+def parseOptions (argv) :
+    """
+    Configure instrumentation from the arguments of a script and return them
+    without option --profile
+
+      The option is only recognized before the first positional argument,
+      so that arguments given as data are left unchanged. To be called by
+      the main block of scripts: importing modules has no side effect.
+    """
+    argv = list(argv)
+    value = None
+    for i, arg in enumerate(argv):
+        if arg == '--' or not arg.startswith('-'):
+            break
+        if arg == '--profile' or arg.startswith('--profile='):
+            del argv[i]
+            value = arg[len('--profile='):] or '1'
+            break
+    configure(value)
+    return argv
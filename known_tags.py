@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2010, 2011 CNRS
+# Author: Florent Lamiraux
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED
+# TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Tags used in activity files
+
+  The tags used in file ~/.activity are stored in ~/.activity.tags, one tag
+  per line after a header giving the size and modification time of the
+  activity file they correspond to. start_or_stop.py and switch_activity.py
+  read them to know which tags are new without reading the activities, and
+  append the new tags of the activities they write, see
+  rollup.appendActivities. The tags are read again from the activity file,
+  through its cache, when it has been modified otherwise. The tags of a
+  database are read from its table of tags.
+"""
+
+import os
+from work_sheet import fileStamp, isDatabase, atomicWrite
+from instrument import phase
+
+headerFormat = '%020d;%020d\n'
+"""
+Size and modification time of the activity file
+"""
+headerSize = len(headerFormat % (0, 0))
+
+def _tagFile (filename) :
+    return filename + '.tags'
+
+def _load (tagFile) :
+    # Return the stamp and the tags of a tag file
+    with open(tagFile, 'r') as f:
+        header = f.readline()
+        if len(header) != headerSize:
+            raise ValueError("invalid header in %s." % tagFile)
+        size, mtime = map(int, header.split(';'))
+        return (size, mtime), set(line.rstrip('\n') for line in f)
+
+def _save (tagFile, stamp, tags) :
+    with atomicWrite(tagFile) as f:
+        f.write(headerFormat % stamp)
+        for t in sorted(tags):
+            f.write(t + '\n')
+
+def buildTags (filename) :
+    """
+    Return the set of tags used in an activity file, read through its cache
+    """
+    from cache import readCached
+    with phase('tags build'):
+        w = readCached(filename, None, columnar = True)
+        return set(w.activities.tagNames)
+
+def loadTags (filename, tagFile = None) :
+    """
+    Return the set of tags used in an activity file
+
+      The tag file is written again if it was not up to date.
+    """
+    if isDatabase(filename):
+        from sqlite_sheet import connect
+        db = connect(filename)
+        try:
+            return set(name for name, in db.execute('SELECT name FROM tags'))
+        finally:
+            db.close()
+    if tagFile is None:
+        tagFile = _tagFile(filename)
+    stamp = fileStamp(filename)
+    if stamp is None:
+        return set()
+    try:
+        with phase('tags load'):
+            saved, tags = _load(tagFile)
+        if saved == stamp:
+            return tags
+    except (IOError, OSError, ValueError):
+        pass
+    tags = buildTags(filename)
+    _save(tagFile, stamp, tags)
+    return tags
+
+def appendTags (filename, activities, before, after, tagFile = None) :
+    """
+    Add the tags of activities appended to an activity file to its tag file
+    and update its stamp, if it was up to date
+
+      Input:
+        - before, after: the stamps of the activity file before and after
+          the activities were appended.
+      To be called holding work_sheet.lockFile(filename).
+    """
+    if tagFile is None:
+        tagFile = _tagFile(filename)
+    try:
+        f = open(tagFile, 'r+')
+    except (IOError, OSError):
+        return
+    with f:
+        header = f.readline()
+        if len(header) != headerSize or \
+                tuple(map(int, header.split(';'))) != tuple(before):
+            return
+        tags = set(line.rstrip('\n') for line in f)
+        f.seek(0, os.SEEK_END)
+        for a in activities:
+            for t in sorted(a.instanceTags - tags):
+                f.write(t + '\n')
+                tags.add(t)
+        f.flush()
+        f.seek(0)
+        f.write(headerFormat % after)
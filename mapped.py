@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2010, 2011 CNRS
+# Author: Florent Lamiraux
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED
+# TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Memory-mapped reading of activity files
+
+  Activity files written by WorkSheet.write and appendActivity are sorted
+  by starting time. A mapped file is searched by bisection over byte
+  offsets, comparing the "YYYY-MM-DD HH:MM" prefix of lines as bytes, so
+  that reading the activities of a time range only touches the pages
+  containing them. Lines are filtered by tags on raw bytes and only
+  selected lines are decoded.
+"""
+
+import mmap
+from activity import Activity
+from work_sheet import WorkSheet, checkTags
+from instrument import phase, count
+
+keyLength = 16
+"""
+Length of the "YYYY-MM-DD HH:MM" prefix of times
+"""
+
+def timeKey (time) :
+    """
+    Return the prefix of the lines of activities starting at a given time,
+    as bytes
+    """
+    return time.strftime('%Y-%m-%d %H:%M').encode()
+
+class MappedFile (object) :
+    """
+    Activity file mapped in memory
+
+      Usage:
+        with MappedFile(filename) as f:
+            w = f.select(start, end)
+    """
+    def __init__ (self, filename) :
+        self.filename = filename
+        with open(filename, 'rb') as f:
+            try:
+                self.map = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+            except ValueError:
+                # empty file
+                self.map = b''
+
+    def __enter__ (self) :
+        return self
+
+    def __exit__ (self, *args) :
+        self.close()
+        return False
+
+    def close (self) :
+        if isinstance(self.map, mmap.mmap):
+            self.map.close()
+
+    def __len__ (self) :
+        return len(self.map)
+
+    def _bisect (self, key, right) :
+        # Offset of the first line whose prefix is not lower than key, or
+        # greater than key if right is True.
+        m = self.map
+        lo, hi = 0, len(m)
+        probes = 0
+        while lo < hi:
+            mid = (lo + hi) // 2
+            begin = m.rfind(b'\n', lo, mid) + 1 or lo
+            end = m.find(b'\n', begin)
+            if end < 0:
+                end = len(m)
+            prefix = m[begin:begin + keyLength]
+            probes += 1
+            if prefix < key or (right and prefix == key):
+                lo = end + 1
+            else:
+                hi = begin
+        count('bisection probes', probes)
+        return min(lo, len(m))
+
+    def offset (self, time) :
+        """
+        Return the offset of the first line of an activity starting at or
+        after a given time, at the minute
+        """
+        return self._bisect(timeKey(time), False)
+
+    def offsetAfter (self, time) :
+        """
+        Return the offset of the first line of an activity starting after a
+        given time, at the minute
+        """
+        return self._bisect(timeKey(time), True)
+
+    def view (self, begin = 0, end = None) :
+        """
+        Return a memoryview on the bytes of the file between two offsets
+        """
+        if end is None:
+            end = len(self.map)
+        return memoryview(self.map)[begin:end]
+
+    def lines (self, begin = 0, end = None) :
+        """
+        Iterate over the lines between two offsets, as bytes without end of
+        line
+        """
+        if end is None:
+            end = len(self.map)
+        m = self.map
+        while begin < end:
+            e = m.find(b'\n', begin, end)
+            if e < 0:
+                e = end
+            if e > begin:
+                yield m[begin:e]
+            begin = e + 1
+
+    def select (self, start = None, end = None, tags = None,
+                ignorePartition = True) :
+        """
+        Return a work sheet of the activities starting between two datetime
+        objects, and having one of given tags
+
+          Input:
+            - start, end: bounds of the range, None for no bound,
+            - tags: iterable of tags, None for any tags.
+          Only the lines of the range are read. If tags are given, the tag
+          field of these lines is searched for the tags as bytes before
+          decoding.
+        """
+        with phase('mapped select'):
+            begin = 0 if start is None else self.offset(start)
+            stop = len(self.map) if end is None else self.offsetAfter(end)
+            count('bytes read', stop - begin)
+            lines = self.lines(begin, stop)
+            if tags is not None:
+                tagSet = set(tags)
+                checkTags(tagSet)
+                patterns = [('"%s"' % t).encode() for t in tagSet]
+                lines = (line for line in lines
+                         if any(p in line[line.rfind(b';'):]
+                                for p in patterns))
+            w = WorkSheet()
+            w.readLines(lines, ignorePartition)
+            if start is not None or end is not None:
+                w = w.extract(lambda a : (start is None or
+                                          a.startTime >= start) and
+                              (end is None or a.startTime <= end))
+        return w
+
+def readBetween (filename, start, end, partition = None, tags = None) :
+    """
+    Read the activities of a file starting between two datetime objects and
+    return them in a work sheet
+
+      Input:
+        - tags: iterable of tags, the activities having none of them are
+                not returned. None for all activities.
+      The file is expected to be sorted, see MappedFile.
+    """
+    if not partition is None:
+        Activity.readPartition (partition)
+    with MappedFile(filename) as f:
+        return f.select(start, end, tags, partition is None)
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2010, 2011 CNRS
+# Author: Florent Lamiraux
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED
+# TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Interactive input of new activities, shared by the scripts
+"""
+
+import sys
+from activity import Activity, TagError
+
+def _answer (f) :
+    return f.readline() == 'y\n'
+
+def promptActivity (f = None) :
+    """
+    Ask the description and tags of a new activity and return it
+
+      Input:
+        - f: the file answers are read from, the standard input by default.
+      Unknown tags are only added after confirmation.
+    """
+    if f is None:
+        f = sys.stdin
+    a = Activity()
+    print("Please write description:")
+    a.description = f.readline()[:-1]
+    print("Do you want to add a tag ? (y/n) ")
+    while _answer(f):
+        tag = f.readline()[:-1]
+        try :
+            a.addTag(tag)
+        except TagError as exc:
+            print("This tag is new. Confirm ? (y/n)")
+            if _answer(f):
+                a.addNewTag(tag)
+        print("Do you want to add a tag ? (y/n) ")
+    return a
@@ -0,0 +1,285 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2010, 2011 CNRS
+# Author: Florent Lamiraux
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED
+# TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Daily totals of activity files
+
+  The totals of file ~/.activity are stored in ~/.activity.rollup: for each
+  day, the time of the closed activities starting that day, in total and by
+  tag. start_or_stop.py and switch_activity.py update the totals when they
+  close an activity, so that statistics do not need to read the activities.
+  The totals record the size and modification time of the activity file
+  they correspond to, and are rebuilt when the file has been modified
+  otherwise. The scripts append the totals of the activities they close to
+  the file and update its fixed width header in place, so that their cost
+  does not depend on the length of the history: lines of the same day and
+  tag are summed when the file is read.
+"""
+
+import os
+import datetime as dt
+from activity import Activity
+from work_sheet import appendActivity, lockFile, fileStamp, atomicWrite, \
+    secondsPerDay
+from instrument import phase
+
+headerFormat = '%020d;%020d;%020d\n'
+"""
+Size and modification time of the activity file, number of closing records
+"""
+headerSize = len(headerFormat % (0, 0, 0))
+
+class Rollup (object) :
+    """
+    Time of closed activities by day and by tag
+
+      - days:  dictionary giving for each day, as a "YYYY-MM-DD" string, a
+               dictionary of times in seconds by tag. The total time of the
+               day is stored with tag None,
+      - size, mtime: size and modification time of the activity file,
+      - journalRecords: number of closing records in the activity file.
+    """
+    def __init__ (self) :
+        self.days = {}
+        self.size = 0
+        self.mtime = 0
+        self.journalRecords = 0
+
+    def _add (self, day, tags, seconds) :
+        totals = self.days.setdefault(day, {})
+        totals[None] = totals.get(None, 0) + seconds
+        for t in tags:
+            totals[t] = totals.get(t, 0) + seconds
+
+    def add (self, activity) :
+        """
+        Add the time of a closed activity
+        """
+        if activity.endTime is None:
+            raise ValueError("activity is not finished.")
+        self._add(*_totals(activity))
+
+    @staticmethod
+    def fromWorkSheet (w) :
+        """
+        Compute the totals of a work sheet
+        """
+        # aggregate is not imported by the scripts toggling activities
+        from aggregate import Aggregator
+        from columnar import epoch
+        r = Rollup()
+        r.journalRecords = w.journalRecords
+        a = Aggregator(w, useNumpy = False)
+        c = a.columns
+        byMask = {}
+        for s, d, m in zip(a.starts, a.durations, c.allMasks()):
+            if d != 0:
+                key = (s // secondsPerDay, m)
+                byMask[key] = byMask.get(key, 0) + d
+        for (day, m), d in sorted(byMask.items()):
+            r._add((epoch + dt.timedelta(days = day)).date().isoformat(),
+                   c.tagSet(m), d)
+        return r
+
+    @staticmethod
+    def load (rollupFile) :
+        """
+        Read totals from a file
+        """
+        r = Rollup()
+        with open(rollupFile, 'r') as f:
+            r.size, r.mtime, r.journalRecords = map(int, f.readline()
+                                                    .split(';'))
+            for line in f:
+                day, tag, seconds = line.rstrip('\n').split(';')
+                totals = r.days.setdefault(day, {})
+                tag = tag.strip('"') if tag else None
+                totals[tag] = totals.get(tag, 0) + int(seconds)
+        return r
+
+    def save (self, rollupFile) :
+        """
+        Write totals in a file, see work_sheet.atomicWrite
+        """
+        with atomicWrite(rollupFile) as f:
+            f.write(headerFormat % (self.size, self.mtime,
+                                    self.journalRecords))
+            for day in sorted(self.days):
+                f.write(_lines(day, self.days[day].items()))
+
+    def isUpToDate (self, stamp) :
+        """
+        Whether the totals correspond to an activity file given its stamp,
+        see work_sheet.fileStamp
+        """
+        return (self.size, self.mtime) == stamp
+
+    def _days (self, start, end) :
+        if start is None and end is None:
+            return self.days.values()
+        start = '' if start is None else start.isoformat()
+        end = '~' if end is None else end.isoformat()
+        return (totals for day, totals in self.days.items()
+                if start <= day <= end)
+
+    def totalTimeBetween (self, start = None, end = None) :
+        """
+        Return the total time in hours of activities starting between two
+        datetime.date objects, bounds included
+        """
+        return sum(totals.get(None, 0) for totals in
+                   self._days(start, end))/3600.
+
+    def timeByTag (self, start = None, end = None) :
+        """
+        Return a dictionary giving the time in hours for each tag of
+        activities starting between two datetime.date objects
+        """
+        result = {}
+        for totals in self._days(start, end):
+            for t, seconds in totals.items():
+                if t is not None:
+                    result[t] = result.get(t, 0) + seconds
+        return dict((t, s/3600.) for t, s in result.items())
+
+    @property
+    def totalTime (self) :
+        """
+        Return total time in hours
+        """
+        return self.totalTimeBetween()
+
+def _totals (activity) :
+    # Day, tags and time in seconds of a closed activity
+    d = Activity.toMinute(activity.endTime) - \
+        Activity.toMinute(activity.startTime)
+    return (activity.startTime.date().isoformat(), activity.instanceTags,
+            d.days*secondsPerDay + d.seconds)
+
+def _lines (day, totals) :
+    # Lines of the times of a day given by (tag, seconds) pairs
+    return ''.join('%s;%s;%d\n' % (day, '' if tag is None else '"%s"' % tag,
+                                   seconds) for tag, seconds in totals)
+
+def _rollupFile (filename) :
+    return filename + '.rollup'
+
+def loadRollup (filename, rollupFile = None) :
+    """
+    Return the totals of an activity file if up to date, None otherwise
+    """
+    if rollupFile is None:
+        rollupFile = _rollupFile(filename)
+    try:
+        with phase('rollup load'):
+            r = Rollup.load(rollupFile)
+    except (IOError, OSError, ValueError):
+        return None
+    if not r.isUpToDate(fileStamp(filename)):
+        return None
+    return r
+
+def saveRollup (filename, w, rollupFile = None) :
+    """
+    Compute and write the totals of an activity file from the work sheet it
+    contains
+    """
+    if rollupFile is None:
+        rollupFile = _rollupFile(filename)
+    with phase('rollup build'):
+        r = Rollup.fromWorkSheet(w)
+    r.size, r.mtime = fileStamp(filename)
+    r.save(rollupFile)
+    return r
+
+def appendActivities (filename, activities, rollupFile = None,
+                      stamp = None) :
+    """
+    Append activities at the end of an activity file and add closed ones to
+    its totals
+
+      Closed activities are expected to be closing records of the last
+      activity of the file, as written by start_or_stop.py and
+      switch_activity.py. The totals are only updated if they were up to
+      date before, otherwise they are rebuilt by the next reader. The status
+      and the tags of the file are updated as well, see status.updateStatus
+      and known_tags.appendTags.
+      Input:
+        - stamp: the stamp of the activity file when its last activity was
+                 read, see work_sheet.lockFile.
+      Return the stamp of the activity file after appending.
+    """
+    if rollupFile is None:
+        rollupFile = _rollupFile(filename)
+    with lockFile(filename, stamp):
+        before = fileStamp(filename)
+        for a in activities:
+            appendActivity(filename, a)
+        after = fileStamp(filename)
+        with phase('rollup append'):
+            _appendTotals(rollupFile, activities, before, after)
+        from status import updateStatus
+        with phase('status update'):
+            updateStatus(filename, activities, before, after)
+        from known_tags import appendTags
+        with phase('tags append'):
+            appendTags(filename, activities, before, after)
+    return after
+
+def _appendTotals (rollupFile, activities, before, after) :
+    """
+    Append the totals of closed activities to a totals file and update its
+    stamp, if it was up to date
+
+      Input:
+        - before, after: the stamps of the activity file before and after
+          the activities were appended.
+    """
+    try:
+        f = open(rollupFile, 'r+')
+    except (IOError, OSError):
+        return
+    with f:
+        header = f.readline()
+        if len(header) != headerSize:
+            return
+        size, mtime, journalRecords = map(int, header.split(';'))
+        if (size, mtime) != before:
+            return
+        f.seek(0, os.SEEK_END)
+        for a in activities:
+            if a.endTime is not None:
+                day, tags, seconds = _totals(a)
+                f.write(_lines(day, [(None, seconds)] +
+                               [(t, seconds) for t in tags]))
+                journalRecords += 1
+        f.flush()
+        f.seek(0)
+        f.write(headerFormat % (after[0], after[1], journalRecords))
@@ -0,0 +1,272 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2010, 2011 CNRS
+# Author: Florent Lamiraux
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED
+# TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Activity files split by month
+
+  Instead of a single file, ~/.activity may be a directory containing a
+  file per month, named YYYY-MM.activity after the month the activities
+  start in, and a manifest listing these shards with their number of
+  lines. Shards have the format of activity files: a closing record starts
+  at the same time as the activity it closes, so that it is appended to the
+  same shard.
+
+  Functions of work_sheet and cache accept such directories in place of
+  activity files and only read the shards overlapping the requested time
+  range. Use
+
+    python shards.py migrate [activity file]
+
+  to convert an activity file, ~/.activity by default, to a directory. The
+  former file is kept with suffix .single.
+"""
+
+import os, sys, shutil, tempfile
+from activity import Activity
+from work_sheet import WorkSheet, lockFile, atomicWrite
+from instrument import count
+
+manifestName = 'manifest'
+suffix = '.activity'
+
+def isSharded (filename) :
+    """
+    Whether an activity file is a directory of shards
+    """
+    return os.path.isdir(filename)
+
+def shardKey (time) :
+    """
+    Return the key of the shard of activities starting at a given time
+    """
+    return '%04d-%02d' % (time.year, time.month)
+
+def shardFile (directory, key) :
+    return os.path.join(directory, key + suffix)
+
+class Manifest (object) :
+    """
+    Shards of a directory with their number of lines, by key
+    """
+    def __init__ (self, directory) :
+        self.directory = directory
+        self.shards = {}
+
+    @staticmethod
+    def load (directory) :
+        m = Manifest(directory)
+        with open(os.path.join(directory, manifestName), 'r') as f:
+            for line in f:
+                key, lines = line.rstrip('\n').split(';')
+                m.shards[key] = int(lines)
+        return m
+
+    def save (self) :
+        """
+        Write the manifest, see work_sheet.atomicWrite
+
+          The manifest is rewritten after each modification of the shards,
+          its size and modification time are the stamp of the directory.
+        """
+        filename = os.path.join(self.directory, manifestName)
+        with atomicWrite(filename) as f:
+            for key in sorted(self.shards):
+                f.write('%s;%d\n' % (key, self.shards[key]))
+
+    def keys (self, start = None, end = None) :
+        """
+        Return the sorted keys of shards that may contain activities
+        starting between two datetime objects
+        """
+        keys = sorted(self.shards)
+        if start is not None:
+            keys = [k for k in keys if k >= shardKey(start)]
+        if end is not None:
+            keys = [k for k in keys if k <= shardKey(end)]
+        return keys
+
+def manifestFile (directory) :
+    return os.path.join(directory, manifestName)
+
+def readShards (directory, partition, start = None, end = None,
+                worksheet = WorkSheet) :
+    """
+    Read the shards overlapping a time range and return the corresponding
+    work sheet
+
+      Input:
+        - start, end: datetime objects, None for no bound,
+        - worksheet: class of the work sheet to return.
+      Activities of the first and last shards that do not start in the
+      range are kept.
+    """
+    if not partition is None:
+        Activity.readPartition (partition)
+    m = Manifest.load(directory)
+    w = worksheet()
+    keys = m.keys(start, end)
+    count('shards read', len(keys))
+    for key in keys:
+        shard = worksheet()
+        shard.read(shardFile(directory, key), partition is None)
+        w.activities.extend(shard.activities)
+        w.journalRecords += shard.journalRecords
+    return w
+
+class ShardedWorkSheet (WorkSheet) :
+    """
+    Work sheet of a directory of shards, read when first needed
+
+      Extractions of time ranges only read the shards overlapping the range.
+      Any other access to the activities reads all the shards.
+    """
+    def __init__ (self, directory, partition = None) :
+        WorkSheet.__init__(self)
+        self.directory = directory
+        self.partition = partition
+        self._activities = None
+
+    @property
+    def activities (self) :
+        if self._activities is None:
+            w = readShards(self.directory, self.partition)
+            self._activities = w.activities
+            self.journalRecords = w.journalRecords
+        return self._activities
+
+    @activities.setter
+    def activities (self, activities) :
+        self._activities = activities
+
+    def extractBetween (self, start, end) :
+        """
+        Extract activities starting between two datetime objects
+
+          If the shards have not been read yet, only the shards overlapping
+          the range are read.
+        """
+        if self._activities is not None:
+            return WorkSheet.extractBetween(self, start, end)
+        return readShards(self.directory, self.partition, start, end)\
+            .extractBetween(start, end)
+
+def readShardsTail (directory, n, partition) :
+    """
+    Read the last n activities of a directory, see work_sheet.readTail
+    """
+    from work_sheet import readTail
+    m = Manifest.load(directory)
+    w = WorkSheet()
+    lines = 0
+    for key in reversed(m.keys()):
+        lines += m.shards[key]
+        shard = readTail(shardFile(directory, key), 2*n, partition)
+        w.activities[0:0] = shard.activities
+        if lines >= 2*n:
+            break
+    w.activities = w.activities[-n:]
+    return w
+
+def appendShard (directory, activity) :
+    """
+    Append an activity to its shard and update the manifest
+
+      To be called with the directory locked, see work_sheet.appendActivity.
+    """
+    key = shardKey(activity.startTime)
+    m = Manifest.load(directory)
+    with open(shardFile(directory, key), 'a') as f :
+        f.write(str(activity)+'\n')
+        f.flush()
+        os.fsync(f.fileno())
+    m.shards[key] = m.shards.get(key, 0) + 1
+    m.save()
+
+def writeShards (directory, w) :
+    """
+    Write a work sheet in the shards of a directory, replacing them
+
+      To be called with the directory locked.
+    """
+    if not w.isSorted():
+        w.sort()
+    byKey = {}
+    for a in w:
+        byKey.setdefault(shardKey(a.startTime), []).append(a)
+    if os.path.exists(manifestFile(directory)):
+        former = Manifest.load(directory).shards
+    else:
+        former = {}
+    m = Manifest(directory)
+    for key, activities in byKey.items():
+        shard = WorkSheet()
+        shard.activities = activities
+        shard.write(shardFile(directory, key))
+        m.shards[key] = len(activities)
+    m.save()
+    for key in set(former) - set(m.shards):
+        os.remove(shardFile(directory, key))
+
+def migrate (filename, partition = None) :
+    """
+    Convert an activity file to a directory of shards
+
+      The file is renamed with suffix .single.
+    """
+    if isSharded(filename):
+        raise RuntimeError("%s is already a directory of shards." % filename)
+    from work_sheet import readFile
+    with lockFile(filename):
+        w = readFile(filename, partition)
+        tmp = tempfile.mkdtemp(prefix = os.path.basename(filename) + '.',
+                               dir = os.path.dirname(
+                                   os.path.abspath(filename)))
+        try:
+            writeShards(tmp, w)
+        except:
+            shutil.rmtree(tmp)
+            raise
+        os.replace(filename, filename + '.single')
+        os.rename(tmp, filename)
+    return w
+
+if __name__ == '__main__':
+    from instrument import parseOptions
+    sys.argv[1:] = parseOptions(sys.argv[1:])
+    if len(sys.argv) < 2 or sys.argv[1] != 'migrate':
+        print (__doc__)
+        sys.exit(1)
+    if len(sys.argv) > 2:
+        filename = sys.argv[2]
+    else:
+        filename = os.getenv('HOME')+"/.activity"
+    w = migrate(filename)
+    print ("%d activities written in %d shards." %
+           (len(w), len(Manifest.load(filename).shards)))
@@ -0,0 +1,321 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2010, 2011 CNRS
+# Author: Florent Lamiraux
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED
+# TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Activity files stored in SQLite databases
+
+  ~/.activity may be a SQLite database with the schema formats.sqliteSchema,
+  recognized by its first bytes, see work_sheet.isDatabase. Functions of
+  work_sheet and cache accept such databases in place of activity files:
+    - readFile returns a DatabaseWorkSheet, whose extractions by time range
+      or tags and sums of times are SQL queries using the indexes on
+      starting times and tags,
+    - readTail and readSince only select the requested rows,
+    - appendActivity inserts an activity, or updates the last one if it
+      closes it, in one transaction.
+  Use
+
+    python formats.py convert ~/.activity ~/.activity.sqlite
+
+  to convert an activity file to a database, then rename the database.
+"""
+
+from activity import Activity
+from work_sheet import WorkSheet, checkTags
+from columnar import toSeconds, fromSeconds
+from instrument import phase, count
+
+timeout = 10.
+"""
+Time in seconds a connection waits for the lock of the database
+"""
+
+def connect (filename) :
+    """
+    Open a connection to a database in autocommit mode
+
+      Transactions are started explicitly, see transaction.
+    """
+    import sqlite3
+    return sqlite3.connect(filename, timeout = timeout,
+                           isolation_level = None)
+
+class transaction (object) :
+    """
+    Context holding the write lock of a database from the start
+
+      The transaction is committed at exit, or rolled back if an exception
+      was raised.
+    """
+    def __init__ (self, db) :
+        self.db = db
+
+    def __enter__ (self) :
+        self.db.execute('BEGIN IMMEDIATE')
+        return self.db
+
+    def __exit__ (self, type, value, traceback) :
+        self.db.execute('COMMIT' if type is None else 'ROLLBACK')
+        return False
+
+def _seconds (t) :
+    # Seconds since epoch of a datetime object, rounded up
+    s = toSeconds(t)
+    if fromSeconds(s) < t:
+        s += 1
+    return s
+
+def selectActivities (db, where = '', parameters = ()) :
+    """
+    Iterate over the activities of a database in insertion order
+
+      Input:
+        - db: a connection to the database,
+        - where: a condition on table activities aliased as a, in SQL,
+        - parameters: the values of the parameters of the condition.
+    """
+    names = dict(db.execute('SELECT id, name FROM tags'))
+    rows = db.execute(
+        'SELECT a.start, a.end, a.description, group_concat(t.tag) '
+        'FROM activities a LEFT JOIN activity_tags t ON t.activity = a.id ' +
+        ('WHERE ' + where + ' ' if where else '') +
+        'GROUP BY a.id ORDER BY a.id', parameters)
+    n = 0
+    for start, end, description, tags in rows:
+        n += 1
+        a = Activity.__new__(Activity)
+        a.startTime = fromSeconds(start)
+        a.endTime = None if end is None else fromSeconds(end)
+        a.description = description
+        a.instanceTags = Activity.internTags(
+            () if tags is None else (names[int(i)] for i in tags.split(',')))
+        yield a
+    count('rows selected', n)
+
+def iterDatabase (filename, where = '', parameters = ()) :
+    """
+    Iterate over the activities of a database file, see selectActivities
+    """
+    db = connect(filename)
+    try:
+        yield from selectActivities(db, where, parameters)
+    finally:
+        db.close()
+
+def _tagCondition (tags) :
+    # Condition on activity_tags selecting given tags
+    return 'tag IN (SELECT id FROM tags WHERE name IN (%s))' % \
+        ', '.join('?'*len(tags))
+
+class DatabaseWorkSheet (WorkSheet) :
+    """
+    Work sheet of a database, read when first needed
+
+      Extractions by time range or tags and sums of times are computed by
+      the database if the activities have not been read yet. Any other
+      access to the activities reads them all.
+    """
+    def __init__ (self, filename, partition = None) :
+        WorkSheet.__init__(self)
+        self.filename = filename
+        self.partition = partition
+        self._activities = None
+        db = connect(filename)
+        try:
+            Activity.tags.update(name for name, in
+                                 db.execute('SELECT name FROM tags'))
+        finally:
+            db.close()
+
+    @property
+    def activities (self) :
+        if self._activities is None:
+            self._activities = self._select().activities
+        return self._activities
+
+    @activities.setter
+    def activities (self, activities) :
+        self._activities = activities
+
+    def _select (self, where = '', parameters = ()) :
+        w = WorkSheet()
+        with phase('select'):
+            for a in iterDatabase(self.filename, where, parameters):
+                w.add(a, self.partition is None)
+        return w
+
+    def _query (self, sql, parameters = ()) :
+        db = connect(self.filename)
+        try:
+            with phase('query'):
+                return db.execute(sql, parameters).fetchall()
+        finally:
+            db.close()
+
+    def extractBetween (self, start, end) :
+        """
+        Extract activities starting between two datetime objects
+        """
+        if self._activities is not None:
+            return WorkSheet.extractBetween(self, start, end)
+        return self._select('a.start BETWEEN ? AND ?',
+                            (_seconds(start), toSeconds(end)))
+
+    def extractUnion (self, tags) :
+        """
+        Extract finished activities related to given set of tags
+        """
+        if self._activities is not None:
+            return WorkSheet.extractUnion(self, tags)
+        count('tag extractions')
+        tagSet = set(tags)
+        checkTags(tagSet)
+        return self._select('a.end IS NOT NULL AND a.id IN (SELECT activity '
+                            'FROM activity_tags WHERE ' +
+                            _tagCondition(tagSet) + ')', sorted(tagSet))
+
+    def extractInter (self, tags) :
+        """
+        Extract finished activities related to all tags in a given set
+        """
+        if self._activities is not None:
+            return WorkSheet.extractInter(self, tags)
+        count('tag extractions')
+        tagSet = set(tags)
+        checkTags(tagSet)
+        if len(tagSet) == 0:
+            return self._select('a.end IS NOT NULL')
+        return self._select('a.end IS NOT NULL AND a.id IN (SELECT activity '
+                            'FROM activity_tags WHERE ' +
+                            _tagCondition(tagSet) + ' GROUP BY activity '
+                            'HAVING count(*) = ?)',
+                            sorted(tagSet) + [len(tagSet)])
+
+    @property
+    def totalTime (self) :
+        """
+        Return total time in hours
+        """
+        if self._activities is not None:
+            return WorkSheet.totalTime.fget(self)
+        (seconds,), = self._query('SELECT sum(end - start) FROM activities '
+                                  'WHERE end IS NOT NULL')
+        return (seconds or 0)/3600.
+
+    def totalTimeByTag (self) :
+        """
+        Return a dictionary giving the total time in hours for each tag
+        """
+        if self._activities is not None:
+            return WorkSheet.totalTimeByTag(self)
+        return dict((name, seconds/3600.) for name, seconds in self._query(
+                'SELECT t.name, sum(a.end - a.start) FROM activities a '
+                'JOIN activity_tags at ON at.activity = a.id '
+                'JOIN tags t ON t.id = at.tag WHERE a.end IS NOT NULL '
+                'GROUP BY t.id'))
+
+def readDatabase (filename, partition = None) :
+    """
+    Return the work sheet of a database, see DatabaseWorkSheet
+    """
+    return DatabaseWorkSheet(filename, partition)
+
+def readDatabaseTail (filename, n, partition = None) :
+    """
+    Read the last n activities of a database, see work_sheet.readTail
+    """
+    w = WorkSheet()
+    with phase('read tail'):
+        for a in iterDatabase(filename, 'a.id IN (SELECT id FROM activities '
+                              'ORDER BY id DESC LIMIT ?)', (n,)):
+            w.add(a, partition is None)
+    return w
+
+def readDatabaseSince (filename, start, partition = None) :
+    """
+    Read the activities of a database starting after a datetime object, see
+    work_sheet.readSince
+    """
+    w = WorkSheet()
+    with phase('read since'):
+        for a in iterDatabase(filename, 'a.start >= ?', (_seconds(start),)):
+            w.add(a, partition is None)
+    return w
+
+def readColumnar (filename, partition = None) :
+    """
+    Read the activities of a database in a ColumnarWorkSheet
+    """
+    from columnar import ColumnarWorkSheet
+    w = ColumnarWorkSheet()
+    with phase('select'):
+        for a in iterDatabase(filename):
+            w.activities.append(a)
+    if partition is not None:
+        w.activities.checkPartition()
+    return w
+
+def appendRecord (filename, activity) :
+    """
+    Add an activity to a database in one transaction
+
+      As a closing record of an activity file, an activity starting at the
+      same time as the last activity of the database, if unfinished,
+      replaces it.
+    """
+    from formats import insertActivities, toMinutes
+    db = connect(filename)
+    try:
+        with transaction(db):
+            last = db.execute('SELECT id, start, end FROM activities '
+                              'ORDER BY id DESC LIMIT 1').fetchone()
+            if last is not None and last[2] is None and \
+                    last[1] == toMinutes(activity.startTime):
+                db.execute('DELETE FROM activity_tags WHERE activity = ?',
+                           (last[0],))
+                db.execute('DELETE FROM activities WHERE id = ?',
+                           (last[0],))
+            insertActivities(db, [activity])
+    finally:
+        db.close()
+
+def writeDatabase (filename, w) :
+    """
+    Replace the activities of a database by those of a work sheet, in one
+    transaction
+    """
+    from formats import insertActivities
+    db = connect(filename)
+    try:
+        with transaction(db), phase('write'):
+            db.execute('DELETE FROM activity_tags')
+            db.execute('DELETE FROM activities')
+            count('activities written', insertActivities(db, w))
+    finally:
+        db.close()
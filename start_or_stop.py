@@ -29,38 +29,60 @@
 
 import sys, os, time
 import datetime as dt
-from work_sheet import WorkSheet, readFile
-from activity import Activity, TagError
+from work_sheet import readTail, fileStamp, ConcurrentModification
+from rollup import appendActivities
+from known_tags import loadTags
+from activity import Activity
+from prompt import promptActivity
 
 filename = os.getenv('HOME')+"/.activity"
 partition = os.getenv('HOME')+"/.activity-partition"
 
+def startOrStop (filename, partition) :
+    """
+    Finish the current activity, or start a new one if none is running
+
+      The file is read again if another program appended to it before this
+      one, the description of a new activity being kept.
+    """
+    a = None
+    while True:
+        stamp = fileStamp (filename)
+        w = readTail (filename, 3, partition)
+        # Tags of older activities are read from the tag file
+        Activity.tags.update (loadTags (filename))
+        Activity.tags.update (Activity.partition)
+        records = []
+        last = w[-1] if len(w) > 0 else None
+        if len(w) > 0 and w[-1].endTime == None :
+            aOld = w[-1]
+            aOld.endTime = dt.datetime.now()
+            print ("Finished: %s" % aOld.description)
+            records.append(aOld)
+        elif a is None:
+            if len(w) > 0:
+                print ("Previous activities:")
+                for aOld in w[-3:]:
+                    print(aOld)
+            print("Starting new activity.")
+            a = promptActivity()
+            w.add(a)
+        if a is not None:
+            if len(records) > 0:
+                # an activity was started meanwhile
+                a.startTime = records[0].endTime
+            elif last is not None and last.endTime > a.startTime:
+                # an activity was started and finished meanwhile
+                a.startTime = last.endTime
+            records.append(a)
+        try:
+            appendActivities(filename, records, stamp = stamp)
+            break
+        except ConcurrentModification:
+            print ("Activity file modified meanwhile: reading it again.")
+
 if __name__ == '__main__':
-    w = readFile (filename, partition)
-    if len(w) > 0 and w[-1].endTime == None :
-        a = w[-1]
-        a.endTime = dt.datetime.now()
-        print ("Finished: %s" % a.description)
-    else:
-        if len(w) > 0:
-            print ("Previous activities:")
-            for a in w[-3:]:
-                print(a)
-        print("Starting new activity.")
-        a = Activity()
-        print("Please write description:")
-        a.description = sys.stdin.readline()[:-1]
-        tagInput = True
-        print("Do you want to add a tag ? (y/n) ")
-        while sys.stdin.readline() == 'y\n':
-            tag = sys.stdin.readline()[:-1]
-            try :
-                a.addTag(tag)
-            except TagError as exc:
-                print("This tag is new. Confirm ? (y/n)")
-                if sys.stdin.readline() == 'y\n':
-                    a.addNewTag(tag)
-            print("Do you want to add a tag ? (y/n) ")
-        w.add(a)
-    w.write(filename)
+    from instrument import parseOptions
+    sys.argv[1:] = parseOptions(sys.argv[1:])
+    startOrStop(filename, partition)
     time.sleep(2.)
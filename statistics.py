@@ -27,33 +27,80 @@
 # ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 # POSSIBILITY OF SUCH DAMAGE.
 
-import os, sys, time
+import os, sys
 import datetime as dt
-from work_sheet import WorkSheet, readFile, workToday, workThisWeek
-from activity import Activity, TagError
+from work_sheet import readSince, workToday, workThisWeek, compactFile, \
+    fileStamp, lockFile, ConcurrentModification, _mondayMorning
+from cache import readCached, saveCache
+from rollup import Rollup, loadRollup, saveRollup
+from activity import Activity
+from instrument import phase
+
+compactThreshold = 100
+"""
+Number of closing records above which the activity file is compacted
+"""
 
 def displayStatistics(w):
     """
     Display statistics
 
-      Input: a WorkSheet object
+      Input: a WorkSheet or a Rollup object
     """
     total = w.totalTime
     print ("Total time: %f" % total)
+    if isinstance(w, Rollup):
+        byTag = w.timeByTag()
+    else:
+        from aggregate import timeByPartition
+        byTag = timeByPartition(w)
     for p in Activity.partition:
         try:
-            t = w.extractUnion([p,]).totalTime
+            t = byTag[p]
             line = "  " + p + ":" + (30 - len (p))*" " + "\t" + "%.2f"%t +\
                 "\t" + "%.2f"%(t/total*100) + "%"
             print (line)
         except:
             pass
 
+def statistics (filename, partition) :
+    """
+    Display the total times by element of the partition, today and this
+    week
+
+      Totals of previous days are read in the rollup of the activity file,
+      which is rebuilt if needed.
+    """
+    Activity.readPartition (partition)
+    r = loadRollup(filename)
+    if r is None or r.journalRecords > compactThreshold:
+        stamp = fileStamp(filename)
+        w = readCached(filename, partition, columnar = True)
+        try:
+            with lockFile(filename, stamp):
+                if w.journalRecords > compactThreshold:
+                    # merge closing records appended by start_or_stop and
+                    # switch_activity
+                    compactFile(filename, partition, w)
+                    saveCache(filename, w)
+                    w.journalRecords = 0
+                r = saveRollup(filename, w)
+        except ConcurrentModification:
+            # an activity was toggled meanwhile: compact next time
+            r = Rollup.fromWorkSheet(w)
+    with phase('display'):
+        displayStatistics(r)
+    # Activities of this week, among which the current one, are read in the
+    # activity file.
+    now = dt.datetime.now()
+    week = readSince(filename, _mondayMorning(now), partition)
+    print ("")
+    print ("Today: %f" % workToday(filename, partition, week).totalTime)
+    print ("This week: %f" %
+           workThisWeek(filename, partition, week).totalTime)
+
 if __name__ == '__main__':
+    from instrument import parseOptions
+    sys.argv[1:] = parseOptions(sys.argv[1:])
     filename = os.getenv ('HOME') + "/.activity"
-    partition = filename + "-partition"
-    w = readFile(filename, partition)
-    displayStatistics(w)
-    print ("")
-    print ("Today: %f" % workToday(filename, partition).totalTime)
-    print ("This week: %f" % workThisWeek(filename, partition).totalTime)
+    statistics(filename, filename + "-partition")
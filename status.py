@@ -0,0 +1,322 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2010, 2011 CNRS
+# Author: Florent Lamiraux
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED
+# TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Status of the current activity
+
+  Usage: python status.py [--watch [seconds]] [--json]
+
+  The status of file ~/.activity is stored in ~/.activity.status, in JSON:
+  the unfinished last activity, if any, and the times of the closed
+  activities starting the current day and week. Status bars poll it with
+
+    python work_logging.py status
+
+  which prints the current activity, the time elapsed since it started and
+  the times of the day and week, the current activity included. The cost
+  does not depend on the length of the history: the scripts closing or
+  starting activities update the status atomically, see
+  rollup.appendActivities, and the activity file is only read again, from
+  the Monday of the current week, if it was modified otherwise. With
+  --watch, the status is printed again every given number of seconds (10 by
+  default) when it changes.
+"""
+
+import os, sys, time
+import datetime as dt
+from activity import Activity
+from work_sheet import readSince, readTail, fileStamp, lockFile, atomicWrite, \
+    secondsPerDay, _mondayMorning
+from instrument import phase
+
+def _statusFile (filename) :
+    return filename + '.status'
+
+class Status (object) :
+    """
+    Current activity and times of the closed activities of the current day
+    and week
+
+      - size, mtime: size and modification time of the activity file,
+      - current:     the unfinished last activity, None if none,
+      - day:         the day of the last closed activity, a datetime.date,
+      - today:       the time in seconds of the closed activities starting
+                     that day,
+      - week:        the Monday of the week of the last closed activity,
+      - thisWeek:    the time in seconds of the closed activities starting
+                     that week.
+    """
+    def __init__ (self) :
+        self.size = 0
+        self.mtime = 0
+        self.current = None
+        self.day = dt.date.min
+        self.today = 0
+        self.week = dt.date.min
+        self.thisWeek = 0
+
+    def add (self, activity) :
+        """
+        Add an activity appended to the activity file
+        """
+        if activity.endTime is None:
+            self.current = activity
+            return
+        if self.current is not None and \
+                self.current.startTime == activity.startTime:
+            self.current = None
+        d = Activity.toMinute(activity.endTime) - \
+            Activity.toMinute(activity.startTime)
+        seconds = d.days*secondsPerDay + d.seconds
+        day = activity.startTime.date()
+        week = day - dt.timedelta(days = day.weekday())
+        if day > self.day:
+            self.day, self.today = day, 0
+        if week > self.week:
+            self.week, self.thisWeek = week, 0
+        if day == self.day:
+            self.today += seconds
+        if week == self.week:
+            self.thisWeek += seconds
+
+    def isUpToDate (self, stamp) :
+        """
+        Whether the status corresponds to an activity file given its stamp,
+        see work_sheet.fileStamp
+        """
+        return (self.size, self.mtime) == stamp
+
+    def times (self, now = None) :
+        """
+        Return a dictionary describing the status at a given time
+
+          Keys are activity, tags, start, elapsed, today and week, times
+          being in seconds. The current activity counts for the current day
+          and week if it started during them.
+        """
+        if now is None:
+            now = dt.datetime.now()
+        morning = dt.datetime.combine(now.date(), dt.time())
+        monday = _mondayMorning(now)
+        today = self.today if self.day == morning.date() else 0
+        week = self.thisWeek if self.week == monday.date() else 0
+        result = {'activity': None, 'tags': [], 'start': None,
+                  'elapsed': 0}
+        a = self.current
+        if a is not None:
+            elapsed = max(0, int((now - Activity.toMinute(a.startTime))
+                                 .total_seconds()))
+            result.update(activity = a.description,
+                          tags = sorted(a.instanceTags),
+                          start = str(a.startTime), elapsed = elapsed)
+            if a.startTime >= morning:
+                today += elapsed
+            if a.startTime >= monday:
+                week += elapsed
+        result['today'] = today
+        result['week'] = week
+        return result
+
+    @staticmethod
+    def load (statusFile) :
+        """
+        Read a status file
+        """
+        import json
+        with open(statusFile, 'r') as f:
+            d = json.load(f)
+        s = Status()
+        s.size, s.mtime = d['size'], d['mtime']
+        if d['current'] is not None:
+            c = d['current']
+            a = Activity()
+            a.startTime = Activity.strToDatetime(c['start'])
+            a.description = c['description']
+            a.instanceTags = Activity.internTags(c['tags'])
+            s.current = a
+        s.day = dt.date.fromisoformat(d['day'])
+        s.today = d['today']
+        s.week = dt.date.fromisoformat(d['week'])
+        s.thisWeek = d['thisWeek']
+        return s
+
+    def save (self, statusFile) :
+        """
+        Write the status in a file, see work_sheet.atomicWrite
+        """
+        import json
+        a = self.current
+        d = {'size': self.size, 'mtime': self.mtime,
+             'current': None if a is None else
+             {'start': str(a.startTime), 'description': a.description,
+              'tags': sorted(a.instanceTags)},
+             'day': self.day.isoformat(), 'today': self.today,
+             'week': self.week.isoformat(), 'thisWeek': self.thisWeek}
+        with atomicWrite(statusFile) as f:
+            json.dump(d, f)
+            f.write('\n')
+
+def buildStatus (filename, now = None) :
+    """
+    Compute the status of an activity file
+
+      Only the activities of the current week and the last activity are
+      read. To be called holding work_sheet.lockFile(filename).
+    """
+    if now is None:
+        now = dt.datetime.now()
+    s = Status()
+    s.size, s.mtime = fileStamp(filename) or (0, 0)
+    if s.size == 0:
+        return s
+    with phase('status build'):
+        for a in readSince(filename, _mondayMorning(now)):
+            if a.endTime is not None:
+                s.add(a)
+        tail = readTail(filename, 1)
+        if len(tail) > 0 and tail[-1].endTime is None:
+            s.current = tail[-1]
+    return s
+
+def updateStatus (filename, activities, before, after, statusFile = None) :
+    """
+    Add activities appended to an activity file to its status
+
+      Input:
+        - before, after: the stamps of the activity file before and after
+          the activities were appended.
+      If the status was not up to date, it is computed from the file. To be
+      called holding work_sheet.lockFile(filename).
+    """
+    if statusFile is None:
+        statusFile = _statusFile(filename)
+    try:
+        s = Status.load(statusFile)
+    except (IOError, OSError, ValueError, KeyError, TypeError):
+        s = None
+    if s is None or not s.isUpToDate(before):
+        s = buildStatus(filename)
+    else:
+        for a in activities:
+            s.add(a)
+        s.size, s.mtime = after
+    s.save(statusFile)
+    return s
+
+def loadStatus (filename, statusFile = None) :
+    """
+    Return the status of an activity file, computed again and saved if not
+    up to date
+    """
+    if statusFile is None:
+        statusFile = _statusFile(filename)
+    try:
+        s = Status.load(statusFile)
+    except (IOError, OSError, ValueError, KeyError, TypeError):
+        s = None
+    if s is None or not s.isUpToDate(fileStamp(filename)):
+        with lockFile(filename):
+            s = buildStatus(filename)
+            s.save(statusFile)
+    return s
+
+def _duration (seconds) :
+    return '%d:%02d' % (seconds // 3600, seconds // 60 % 60)
+
+def formatStatus (times) :
+    """
+    Return the line displaying a dictionary returned by Status.times
+    """
+    if times['activity'] is None:
+        current = 'no activity'
+    else:
+        current = '%s (%s) %s' % (times['activity'], ', '.join(times['tags']),
+                                  _duration(times['elapsed']))
+    return '%s | today %s | week %s' % (current, _duration(times['today']),
+                                        _duration(times['week']))
+
+def watch (filename, interval = 10., asJson = False, f = None) :
+    """
+    Print the status of an activity file each time it changes
+
+      The status is checked every interval seconds: the status file is only
+      read again when modified.
+    """
+    if f is None:
+        f = sys.stdout
+    statusFile = _statusFile(filename)
+    s = None
+    modified = None
+    last = None
+    while True:
+        try:
+            st = os.stat(statusFile)
+            stamp = (st.st_size, st.st_mtime_ns)
+        except OSError:
+            stamp = None
+        if s is None or stamp != modified or \
+                not s.isUpToDate(fileStamp(filename)):
+            s = loadStatus(filename, statusFile)
+            st = os.stat(statusFile)
+            modified = (st.st_size, st.st_mtime_ns)
+        line = _format(s.times(), asJson)
+        if line != last:
+            f.write(line + '\n')
+            f.flush()
+            last = line
+        time.sleep(interval)
+
+def _format (times, asJson) :
+    if asJson:
+        import json
+        # elapsed times at the minute, as in text
+        times = dict(times)
+        for key in ('elapsed', 'today', 'week'):
+            times[key] = times[key] // 60 * 60
+        return json.dumps(times)
+    return formatStatus(times)
+
+if __name__ == '__main__':
+    from instrument import parseOptions
+    sys.argv[1:] = parseOptions(sys.argv[1:])
+    filename = os.getenv('HOME') + "/.activity"
+    args = sys.argv[1:]
+    asJson = '--json' in args
+    if asJson:
+        args.remove('--json')
+    if len(args) > 0 and args[0] == '--watch':
+        try:
+            watch(filename, float(args[1]) if len(args) > 1 else 10., asJson)
+        except KeyboardInterrupt:
+            pass
+    elif len(args) > 0:
+        print (__doc__)
+        sys.exit(1)
+    else:
+        print (_format(loadStatus(filename).times(), asJson))
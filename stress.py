@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2010, 2011 CNRS
+# Author: Florent Lamiraux
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED
+# TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Stress test of concurrent writers
+
+  Usage: python stress.py [--writers n] [--toggles n] [--readers n]
+                          [--layout text|shards|sqlite]
+
+  Writers toggle activities in the same activity file at the same time with
+  work_logging.py toggle, while readers display statistics, compacting the
+  file when closing records accumulate. Each run takes place in a temporary
+  home directory. At the end, the activity file should be a sequence of
+  well paired records: each closing record finishes the activity opened
+  last, each activity started by a writer is found once, all activities but
+  the last one are closed and none overlap. The test exits with status 1 and
+  prints the defects otherwise.
+"""
+
+import sys, os, shutil, tempfile, subprocess, argparse
+from concurrent.futures import ThreadPoolExecutor
+from activity import Activity
+from work_sheet import readFile, isDatabase
+from validation import checkActivities, UNCLOSED
+
+tag = 'administration'
+"""
+Tag of the activities started by writers, the only element of the partition
+"""
+
+def _run (home, args, stdin = '') :
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          'work_logging.py')
+    p = subprocess.run([sys.executable, script] + args, input =
+                       stdin.encode(), env = dict(os.environ, HOME = home),
+                       capture_output = True)
+    if p.returncode != 0:
+        raise RuntimeError("work_logging.py %s failed:\n%s" %
+                           (' '.join(args), p.stderr.decode()))
+    return p.stdout.decode()
+
+def writer (home, i, toggles) :
+    """
+    Toggle activities and return the descriptions of those started
+    """
+    started = []
+    for k in range(toggles):
+        description = 'writer %d toggle %d' % (i, k)
+        output = _run(home, ['toggle'], '%s\ny\n%s\nn\n' % (description, tag))
+        if 'Starting new activity.' in output:
+            started.append(description)
+    return started
+
+def reader (home, runs) :
+    for k in range(runs):
+        _run(home, ['statistics'])
+
+def checkPairing (filename) :
+    """
+    Iterate over the defects of the records of a text activity file
+
+      An open record should only follow closed activities, a closing record
+      should finish the activity opened last.
+    """
+    current = None
+    with open(filename) as f:
+        for n, line in enumerate(f, 1):
+            a = Activity.fromLine(line)
+            if current is not None and a.startTime != current.startTime:
+                yield "line %d: %s starts while %s is open." % \
+                    (n, a.description, current.description)
+            elif current is not None and a.description != \
+                    current.description:
+                yield "line %d: %s closes %s." % \
+                    (n, a.description, current.description)
+            current = a if a.endTime is None else None
+
+def checkFile (filename, partition, started) :
+    """
+    Return the defects of an activity file written by writers
+
+      Input:
+        - started: the descriptions of the activities started by writers.
+    """
+    defects = []
+    if os.path.isfile(filename) and not isDatabase(filename):
+        defects.extend(checkPairing(filename))
+    w = readFile(filename, partition)
+    for finding in checkActivities(w):
+        if finding.kind != UNCLOSED:
+            defects.append(str(finding))
+    for a in w[:-1]:
+        if a.endTime is None:
+            defects.append("%s is not closed." % a.description)
+    descriptions = [a.description for a in w]
+    if sorted(descriptions) != sorted(started):
+        missing = set(started) - set(descriptions)
+        extra = len(descriptions) - len(set(descriptions)) + \
+            len(set(descriptions) - set(started))
+        defects.append("%d started activities missing, %d duplicated or "
+                       "unknown." % (len(missing), extra))
+    return defects
+
+def stress (writers, toggles, readers, layout) :
+    """
+    Run writers and readers on a new activity file and return the defects
+    """
+    home = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(home, '.activity')
+        partition = filename + '-partition'
+        with open(partition, 'w') as f:
+            f.write(tag + '\n')
+        if layout == 'shards':
+            os.mkdir(filename)
+            from shards import Manifest
+            Manifest(filename).save()
+        elif layout == 'sqlite':
+            from formats import writeActivities
+            writeActivities(filename, [], 'sqlite')
+        else:
+            open(filename, 'w').close()
+        with ThreadPoolExecutor(writers + readers) as pool:
+            results = [pool.submit(writer, home, i, toggles)
+                       for i in range(writers)]
+            statistics = [pool.submit(reader, home, toggles)
+                          for i in range(readers)]
+            started = []
+            for r in results:
+                started.extend(r.result())
+            for r in statistics:
+                r.result()
+        return checkFile(filename, partition, started)
+    finally:
+        shutil.rmtree(home)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = "Stress test of "
+                                     "concurrent writers")
+    parser.add_argument('--writers', type = int, default = 8,
+                        help = "number of writers")
+    parser.add_argument('--toggles', type = int, default = 20,
+                        help = "number of toggles by writer")
+    parser.add_argument('--readers', type = int, default = 2,
+                        help = "number of readers")
+    parser.add_argument('--layout', choices = ('text', 'shards', 'sqlite'),
+                        default = 'text', help = "layout of the activity "
+                        "file")
+    args = parser.parse_args()
+    defects = stress(args.writers, args.toggles, args.readers, args.layout)
+    for d in defects:
+        print (d)
+    print ("%d defect(s)." % len(defects), file = sys.stderr)
+    sys.exit(1 if defects else 0)
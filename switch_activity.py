@@ -29,47 +29,63 @@
 
 import sys, os, time
 import datetime as dt
-from work_sheet import WorkSheet, readFile
-from activity import Activity, TagError
+from work_sheet import readTail, fileStamp, ConcurrentModification
+from rollup import appendActivities
+from known_tags import loadTags
+from activity import Activity
+from prompt import promptActivity
 
 filename = os.getenv('HOME')+"/.activity"
 partition = os.getenv('HOME')+"/.activity-partition"
 
-if __name__ == '__main__':
-    now = dt.datetime.now()
-    w = readFile (filename, partition)
-    if len(w) == 0:
-        raise RuntimeError(".activity file is empty.")
-    aOld = w[-1]
-    if aOld.endTime:
-        #No pending activity, resume lattest one
-        aNew = Activity()
-        aNew.startTime = now
-        aNew.description = aOld.description
-        aNew.instanceTags = aOld.instanceTags
-        print ("Resume %s" % aNew.description)
-    else:
-        aOld.endTime = now
-        print ("Finished: %s" % aOld.description)
-        print ("Previous activities:")
-        for a in w[-3:]:
-            print(a)
-        print("Starting new activity.")
-        aNew = Activity()
+def switchActivity (filename, partition) :
+    """
+    Finish the current activity and start a new one, or resume the last
+    activity if none is running
+
+      The file is read again if another program appended to it before this
+      one, the description of a new activity being kept.
+    """
+    aNew = None
+    while True:
+        now = dt.datetime.now()
+        stamp = fileStamp (filename)
+        w = readTail (filename, 3, partition)
+        # Tags of older activities are read from the tag file
+        Activity.tags.update (loadTags (filename))
+        Activity.tags.update (Activity.partition)
+        if len(w) == 0:
+            raise RuntimeError(".activity file is empty.")
+        aOld = w[-1]
+        if aOld.endTime and aNew is None:
+            #No pending activity, resume lattest one
+            aNew = Activity()
+            aNew.startTime = now
+            aNew.description = aOld.description
+            aNew.instanceTags = aOld.instanceTags
+            print ("Resume %s" % aNew.description)
+        elif not aOld.endTime:
+            aOld.endTime = now
+            print ("Finished: %s" % aOld.description)
+        if aNew is None:
+            print ("Previous activities:")
+            for a in w[-3:]:
+                print(a)
+            print("Starting new activity.")
+            aNew = promptActivity()
         aNew.startTime = now
-        print("Please write description:")
-        aNew.description = sys.stdin.readline()[:-1]
-        tagInput = True
-        print("Do you want to add a tag ? (y/n) ")
-        while sys.stdin.readline() == 'y\n':
-            tag = sys.stdin.readline()[:-1]
-            try :
-                aNew.addTag(tag)
-            except TagError as exc:
-                print("This tag is new. Confirm ? (y/n)")
-                if sys.stdin.readline() == 'y\n':
-                    aNew.addNewTag(tag)
-            print("Do you want to add a tag ? (y/n) ")
-    w.add(aNew)
-    w.write(filename)
+        w.add(aNew)
+        try:
+            if aOld.endTime == now:
+                appendActivities(filename, [aOld, aNew], stamp = stamp)
+            else:
+                appendActivities(filename, [aNew], stamp = stamp)
+            break
+        except ConcurrentModification:
+            print ("Activity file modified meanwhile: reading it again.")
+
+if __name__ == '__main__':
+    from instrument import parseOptions
+    sys.argv[1:] = parseOptions(sys.argv[1:])
+    switchActivity(filename, partition)
     time.sleep(2.)
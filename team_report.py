@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2010, 2011 CNRS
+# Author: Florent Lamiraux
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED
+# TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Team report
+
+  Usage: python team_report.py [--partition file] [--jobs n]
+                               [--period day|week|month] [--json]
+                               activity file ...
+
+  Activity files, or directories of shards, typically one per member of a
+  team, are read and aggregated in parallel by a pool of processes. Each
+  worker returns the partial sums of a file, by tag and by period and tag,
+  which are merged by the parent process. The report gives the time spent
+  on each element of the partition by each member and by the team.
+"""
+
+import os, sys, json, argparse
+from concurrent.futures import ProcessPoolExecutor
+from activity import Activity
+from columnar import ColumnarWorkSheet
+from work_sheet import isDatabase
+from aggregate import Aggregator, formatPeriod
+
+class Report (object) :
+    """
+    Partial sums of times in hours of one or several activity files
+
+      - files:      number of files,
+      - activities: number of activities,
+      - total:      total time,
+      - byTag:      dictionary of times by tag,
+      - byPeriod:   dictionary of times by (period, tag) tuples.
+      Reports are merged by addition, as work sheets are concatenated.
+    """
+    def __init__ (self) :
+        self.files = 0
+        self.activities = 0
+        self.total = 0.
+        self.byTag = {}
+        self.byPeriod = {}
+
+    def __add__ (self, other) :
+        res = Report()
+        res.files = self.files + other.files
+        res.activities = self.activities + other.activities
+        res.total = self.total + other.total
+        for d, d1, d2 in ((res.byTag, self.byTag, other.byTag),
+                          (res.byPeriod, self.byPeriod, other.byPeriod)):
+            d.update(d1)
+            for k, t in d2.items():
+                d[k] = d.get(k, 0) + t
+        return res
+
+    def byPartition (self) :
+        """
+        Return the times of the elements of the partition
+        """
+        return dict((p, self.byTag[p]) for p in sorted(Activity.partition)
+                    if p in self.byTag)
+
+    def toDict (self) :
+        """
+        Return the report as a dictionary serializable in JSON
+        """
+        periods = {}
+        for (period, tag), t in self.byPeriod.items():
+            periods.setdefault(formatPeriod(period), {})[tag] = t
+        return {'files': self.files, 'activities': self.activities,
+                'total': self.total, 'partition': self.byPartition(),
+                'tags': self.byTag,
+                'periods': dict(sorted(periods.items()))}
+
+def readActivities (filename) :
+    """
+    Read an activity file or a directory of shards in a ColumnarWorkSheet
+    """
+    if os.path.isdir(filename):
+        from shards import readShards
+        return readShards(filename, None, worksheet = ColumnarWorkSheet)
+    if isDatabase(filename):
+        from sqlite_sheet import readColumnar
+        return readColumnar(filename)
+    w = ColumnarWorkSheet()
+    w.read(filename, True)
+    return w
+
+def partialSums (filename, partition = None, period = 'week') :
+    """
+    Read an activity file and return its Report
+
+      Run by the workers of the process pool.
+    """
+    if partition is not None:
+        Activity.readPartition (partition)
+    w = readActivities(filename)
+    if partition is not None:
+        w.activities.checkPartition()
+    a = Aggregator(w)
+    r = Report()
+    r.files = 1
+    r.activities = len(w)
+    r.total = w.totalTime
+    r.byTag = a.timeByTag()
+    r.byPeriod = a.timeByPeriodAndTag(period)
+    return r
+
+def teamReport (filenames, partition = None, period = 'week', jobs = None) :
+    """
+    Compute the reports of activity files in parallel
+
+      Return the list of reports of the files and their sum.
+      Input:
+        - jobs: number of processes, the number of processors if None. If
+                1, files are read in this process.
+    """
+    n = len(filenames)
+    if jobs == 1:
+        reports = [partialSums(f, partition, period) for f in filenames]
+    else:
+        with ProcessPoolExecutor(max_workers = jobs) as executor:
+            reports = list(executor.map(partialSums, filenames,
+                                        [partition]*n, [period]*n))
+    total = Report()
+    for r in reports:
+        total = total + r
+    return reports, total
+
+def _display (name, report) :
+    print ("%s: %f" % (name, report.total))
+    for p, t in report.byPartition().items():
+        print ("  " + p + ":" + (30 - len (p))*" " + "\t" + "%.2f"%t +
+               "\t" + "%.2f"%(t/report.total*100 if report.total else 0) +
+               "%")
+
+if __name__ == '__main__':
+    from instrument import parseOptions
+    sys.argv[1:] = parseOptions(sys.argv[1:])
+    parser = argparse.ArgumentParser(description = "Team report")
+    parser.add_argument('files', nargs = '+', help = "activity files")
+    parser.add_argument('--partition', default = os.path.join(
+            os.getenv('HOME', ''), '.activity-partition'),
+                        help = "partition file")
+    parser.add_argument('--jobs', type = int, default = None,
+                        help = "number of processes")
+    parser.add_argument('--period', default = 'week',
+                        choices = ('day', 'week', 'month'))
+    parser.add_argument('--json', action = 'store_true',
+                        help = "print the report in JSON")
+    args = parser.parse_args()
+    Activity.readPartition (args.partition)
+    reports, total = teamReport(args.files, args.partition, args.period,
+                                args.jobs)
+    if args.json:
+        print (json.dumps({'files': dict((f, r.toDict()) for f, r in
+                                         zip(args.files, reports)),
+                           'team': total.toDict()}, indent = 2))
+    else:
+        for f, r in zip(args.files, reports):
+            _display(f, r)
+        print ("")
+        _display("Team", total)
@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2010, 2011 CNRS
+# Author: Florent Lamiraux
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED
+# TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Calendar timesheets
+
+  Usage: python timesheet.py [--period day|week|month] [--from date]
+                             [--to date] [--format text|csv|json]
+                             [--partition file] [activity file]
+
+  A timesheet is a dense matrix giving the time spent on each element of the
+  partition, or on given tags, during each day, week or month of a range of
+  dates. It is built in one pass over the activities of a work sheet.
+  Activities crossing the boundary of a period, midnight for days, Monday
+  midnight for weeks, are split between the periods. Unfinished activities
+  count for zero. Dates are written YYYY-MM-DD.
+"""
+
+import os, sys, csv, json, argparse
+import datetime as dt
+from activity import Activity
+from work_sheet import secondsPerDay
+from columnar import ActivityColumns, ColumnarWorkSheet, noTime, toSeconds
+from aggregate import periods, periodKey, periodFirstDay, periodLabel, \
+    formatPeriod
+from instrument import phase
+
+class Timesheet (object) :
+    """
+    Times in seconds by period and tag
+
+      Members:
+        - period: 'day', 'week' or 'month',
+        - first:  the key of the first period, see periodKey,
+        - tags:   the list of tags of the columns,
+        - rows:   a list of rows of times by tag, one for each period from
+                  first on.
+    """
+    def __init__ (self, period, tags) :
+        if not period in periods:
+            raise ValueError("unknown period %r." % period)
+        self.period = period
+        self.tags = list(tags)
+        self.first = 0
+        self.rows = []
+
+    def __len__ (self) :
+        return len(self.rows)
+
+    def labels (self) :
+        """
+        Return the labels of the periods of the rows
+        """
+        return [formatPeriod(periodLabel(self.period, self.first + i))
+                for i in range(len(self.rows))]
+
+    def _row (self, key) :
+        # Extend the matrix to include the period of given key
+        if len(self.rows) == 0:
+            self.first = key
+        n = len(self.tags)
+        if key < self.first:
+            self.rows[0:0] = [[0]*n for i in range(self.first - key)]
+            self.first = key
+        while key >= self.first + len(self.rows):
+            self.rows.append([0]*n)
+        return self.rows[key - self.first]
+
+    def add (self, columns, start = None, end = None) :
+        """
+        Add the times of activities
+
+          Input:
+            - columns: an ActivityColumns object,
+            - start, end: if not None, the range of times in seconds since
+              epoch to which activities are clipped.
+        """
+        period = self.period
+        tags = dict((t, j) for j, t in enumerate(self.tags))
+        columnsByMask = {}
+        firstDays = {}
+        for s, e, m in zip(columns.starts, columns.ends, columns.allMasks()):
+            if e == noTime:
+                continue
+            if start is not None and s < start:
+                s = start
+            if end is not None and e > end:
+                e = end
+            if e <= s:
+                continue
+            selected = columnsByMask.get(m)
+            if selected is None:
+                selected = [tags[t] for t in columns.tagSet(m) if t in tags]
+                columnsByMask[m] = selected
+            if len(selected) == 0:
+                continue
+            key = periodKey(period, s // secondsPerDay)
+            while True:
+                boundary = firstDays.get(key + 1)
+                if boundary is None:
+                    boundary = secondsPerDay*periodFirstDay(period, key + 1)
+                    firstDays[key + 1] = boundary
+                row = self._row(key)
+                piece = min(e, boundary) - s
+                for j in selected:
+                    row[j] += piece
+                if e <= boundary:
+                    break
+                s = boundary
+                key += 1
+
+    def hours (self) :
+        """
+        Return the rows with times in hours
+        """
+        return [[t/3600. for t in row] for row in self.rows]
+
+    def toDict (self) :
+        """
+        Return the timesheet as a dictionary serializable in JSON
+        """
+        return {'period': self.period, 'tags': self.tags,
+                'rows': [{'period': label, 'hours': dict(zip(self.tags, row)),
+                          'total': sum(row)}
+                         for label, row in zip(self.labels(), self.hours())]}
+
+    def writeCsv (self, f) :
+        """
+        Write the timesheet in CSV with a header line, a line by period and
+        a column by tag, followed by the total of the period
+        """
+        writer = csv.writer(f)
+        writer.writerow(['period'] + self.tags + ['total'])
+        for label, row in zip(self.labels(), self.hours()):
+            writer.writerow([label] + ['%.2f' % t for t in row] +
+                            ['%.2f' % sum(row)])
+
+    def writeJson (self, f) :
+        json.dump(self.toDict(), f, indent = 2)
+        f.write('\n')
+
+    def writeText (self, f) :
+        width = max([len(t) for t in self.tags] + [7])
+        f.write('%-10s' % '' + ''.join(' %*s' % (width, t)
+                                      for t in self.tags + ['total']) + '\n')
+        for label, row in zip(self.labels(), self.hours()):
+            f.write('%-10s' % label + ''.join(' %*.2f' % (width, t)
+                                             for t in row + [sum(row)])
+                    + '\n')
+
+def timesheet (w, period = 'day', start = None, end = None, tags = None) :
+    """
+    Return the Timesheet of a work sheet
+
+      Input:
+        - w: a work sheet, a ColumnarWorkSheet is not copied,
+        - period: 'day', 'week' or 'month',
+        - start, end: datetime.datetime objects bounding the timesheet, if
+          not None,
+        - tags: the tags of the columns, by default the sorted elements of
+          the partition.
+      Periods without activity inside the range are included in the rows.
+    """
+    if tags is None:
+        tags = sorted(Activity.partition)
+    if isinstance(w, ColumnarWorkSheet):
+        c = w.activities
+    else:
+        c = ActivityColumns()
+        for a in w:
+            c.append(a)
+    t = Timesheet(period, tags)
+    s = None if start is None else toSeconds(start)
+    e = None if end is None else toSeconds(end)
+    with phase('timesheet'):
+        t.add(c, s, e)
+        if s is not None:
+            t._row(periodKey(period, s // secondsPerDay))
+        if e is not None:
+            t._row(periodKey(period, (e - 1) // secondsPerDay))
+    return t
+
+def _date (s) :
+    return dt.datetime.strptime(s, '%Y-%m-%d')
+
+if __name__ == '__main__':
+    from instrument import parseOptions
+    sys.argv[1:] = parseOptions(sys.argv[1:])
+    from cache import readCached
+    home = os.getenv('HOME', '')
+    parser = argparse.ArgumentParser(description = "Calendar timesheet")
+    parser.add_argument('file', nargs = '?', default = os.path.join(
+            home, '.activity'), help = "activity file")
+    parser.add_argument('--partition', default = os.path.join(
+            home, '.activity-partition'), help = "partition file")
+    parser.add_argument('--period', default = 'day', choices = periods)
+    parser.add_argument('--from', dest = 'start', type = _date,
+                        default = None, help = "first day")
+    parser.add_argument('--to', dest = 'end', type = _date, default = None,
+                        help = "last day")
+    parser.add_argument('--format', default = 'text',
+                        choices = ('text', 'csv', 'json'))
+    args = parser.parse_args()
+    w = readCached(args.file, args.partition, columnar = True)
+    end = None if args.end is None else args.end + dt.timedelta(days = 1)
+    t = timesheet(w, args.period, args.start, end)
+    if args.format == 'csv':
+        t.writeCsv(sys.stdout)
+    elif args.format == 'json':
+        t.writeJson(sys.stdout)
+    else:
+        t.writeText(sys.stdout)
@@ -0,0 +1,294 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2010, 2011 CNRS
+# Author: Florent Lamiraux
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED
+# TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Consistency checks of activity files
+
+  Usage: python validation.py [--partition file] [--repair output]
+                              [activity file]
+
+  Activities are checked in one pass while they are in chronological order,
+  otherwise in the order of their starting times after reading the whole
+  file, see checkFile. Each defect is reported by a Finding of one of the
+  following kinds:
+    - overlap: the activity starts before the end of a previous one,
+    - negative duration: the activity ends before it starts,
+    - too long: the activity lasts more than a day,
+    - unclosed: the activity is not finished although another one follows.
+  With --repair, the file is read and a repaired copy is written activity
+  by activity, see repairActivities. Output may be the activity file itself.
+"""
+
+import os, sys, itertools, argparse
+import datetime as dt
+from activity import Activity
+
+OVERLAP = 'overlap'
+NEGATIVE_DURATION = 'negative duration'
+TOO_LONG = 'too long'
+UNCLOSED = 'unclosed'
+
+maxDuration = dt.timedelta(days = 1)
+"""
+Maximal duration of an activity
+"""
+
+class Finding (object) :
+    """
+    Defect of an activity
+
+      Members:
+        - kind: one of OVERLAP, NEGATIVE_DURATION, TOO_LONG and UNCLOSED,
+        - position: the position of the activity in the work sheet or file,
+        - activity: the activity,
+        - other: for an overlap, the previous activity ending last.
+    """
+    __slots__ = ('kind', 'position', 'activity', 'other')
+
+    def __init__ (self, kind, position, activity, other = None) :
+        self.kind = kind
+        self.position = position
+        self.activity = activity
+        self.other = other
+
+    def __repr__ (self) :
+        return "Finding(%r, %r, %s)" % (self.kind, self.position,
+                                         self.activity.startTime)
+
+    def __str__ (self) :
+        result = "{0}:\t {1}: {2}".format(self.activity.startTime, self.kind,
+                                          self.activity.description)
+        if self.other is not None:
+            result += " (until {0}: {1})".format(self.other.endTime,
+                                                 self.other.description)
+        return result
+
+def checkActivities (activities, positions = None) :
+    """
+    Iterate over the defects of activities sorted by starting time
+
+      Input:
+        - activities: an iterable over activities sorted by starting time,
+        - positions: an iterable over the positions of the activities to
+          report in findings, by default their ranks.
+      An activity overlapping several previous ones is reported once, with
+      the one ending last.
+    """
+    if positions is None:
+        positions = itertools.count()
+    zero = dt.timedelta(0)
+    previous = None
+    last = None
+    lastEnd = None
+    for i, a in zip(positions, activities):
+        if previous is not None and previous.endTime is None:
+            yield Finding(UNCLOSED, previousPosition, previous)
+        if lastEnd is not None and a.startTime < lastEnd:
+            yield Finding(OVERLAP, i, a, last)
+        end = a.endTime
+        if end is not None:
+            d = end - a.startTime
+            if d < zero:
+                yield Finding(NEGATIVE_DURATION, i, a)
+            elif d > maxDuration:
+                yield Finding(TOO_LONG, i, a)
+            if lastEnd is None or end > lastEnd:
+                last, lastEnd = a, end
+        previous, previousPosition = a, i
+
+def checkWorkSheet (w) :
+    """
+    Return the list of the defects of the activities of a work sheet
+
+      Activities are visited in the order of the index of starting times of
+      the work sheet, see WorkSheet.startTimes. Positions of findings are
+      positions in the work sheet.
+    """
+    starts = w.startTimes()
+    if w.isSorted():
+        order = range(len(starts))
+    else:
+        order = sorted(range(len(starts)), key = starts.__getitem__)
+    activities = w.activities
+    return list(checkActivities((activities[i] for i in order), order))
+
+class UnsortedActivities (Exception) :
+    """
+    Raised when an activity starts before the previous one of a file
+    """
+    pass
+
+def _checkOrder (activities) :
+    # Iterate over activities, raising UnsortedActivities if one starts
+    # before the previous one
+    previous = None
+    for i, a in enumerate(activities):
+        if previous is not None and a.startTime < previous.startTime:
+            raise UnsortedActivities("activity %d starts before the previous "
+                                     "one." % i)
+        previous = a
+        yield a
+
+def checkFile (filename, partition = None) :
+    """
+    Return the list of the defects of the activities of a file
+
+      Input:
+        - filename: the activity file, '-' for the standard input,
+        - partition: the partition file, None to skip the partition check.
+      Activities are checked in one pass, see work_sheet.iterActivities,
+      while they are sorted by starting time. Otherwise the file is read in
+      a work sheet and checked by checkWorkSheet, except the standard input
+      for which UnsortedActivities is raised.
+    """
+    from work_sheet import iterActivities, readFile
+    try:
+        return list(checkActivities(_checkOrder(iterActivities(filename,
+                                                               partition))))
+    except UnsortedActivities:
+        if filename == '-':
+            raise
+    return checkWorkSheet(readFile(filename, partition))
+
+def _withEnd (a, end) :
+    result = Activity()
+    result.startTime = a.startTime
+    result.endTime = end
+    result.description = a.description
+    result.instanceTags = a.instanceTags
+    return result
+
+def _repair (a, i, findings) :
+    # Fix the duration of an activity whose end is final
+    if a.endTime is None:
+        return a
+    d = a.endTime - a.startTime
+    if d < dt.timedelta(0):
+        findings.append(Finding(NEGATIVE_DURATION, i, a))
+        return _withEnd(a, a.startTime)
+    if d > maxDuration:
+        findings.append(Finding(TOO_LONG, i, a))
+        return _withEnd(a, a.startTime + maxDuration)
+    return a
+
+def repairActivities (activities, findings = None) :
+    """
+    Iterate over activities in chronological order with defects repaired
+
+      Input:
+        - activities: an iterable over activities in chronological order,
+        - findings: a list to which the findings are appended, if any.
+      Only one activity is kept in memory. Repairs are:
+        - an unclosed activity followed by another one, or an activity
+          ending after the start of the next one, ends when the next one
+          starts,
+        - an activity ending before it starts gets a null duration,
+        - an activity longer than maxDuration is shortened.
+      Repaired activities are copies. An activity starting before the
+      previous one is reported as an overlap and left unchanged.
+    """
+    if findings is None:
+        findings = []
+    previous = None
+    for i, a in enumerate(activities):
+        if previous is not None:
+            if previous.startTime <= a.startTime:
+                if previous.endTime is None:
+                    findings.append(Finding(UNCLOSED, i - 1, previous))
+                    previous = _withEnd(previous, a.startTime)
+                elif previous.endTime > a.startTime:
+                    findings.append(Finding(OVERLAP, i, a, previous))
+                    previous = _withEnd(previous, a.startTime)
+            else:
+                findings.append(Finding(OVERLAP, i, a, previous))
+            yield _repair(previous, i - 1, findings)
+        previous = a
+    if previous is not None:
+        yield _repair(previous, i, findings)
+
+def repairFile (filename, output, partition = None) :
+    """
+    Write a repaired copy of an activity file and return the findings
+
+      Input:
+        - filename: the activity file, '-' for the standard input,
+        - output: the repaired file, possibly filename,
+        - partition: the partition file, None to skip the partition check.
+      Activities are read and written one by one, see
+      work_sheet.iterActivities and repairActivities. The output is written
+      with work_sheet.atomicWrite, under lockFile(output). An output that is
+      a directory of shards or a database keeps its layout: the repaired
+      activities replace its content as in work_sheet.compactFile.
+    """
+    from work_sheet import WorkSheet, iterActivities, lockFile, writeText, \
+        atomicWrite, isDatabase
+    findings = []
+    activities = repairActivities(iterActivities(filename, partition),
+                                  findings)
+    with lockFile(output):
+        if os.path.isdir(output) or isDatabase(output):
+            w = WorkSheet()
+            w.activities = list(activities)
+            if os.path.isdir(output):
+                import shards
+                shards.writeShards(output, w)
+            else:
+                import sqlite_sheet
+                sqlite_sheet.writeDatabase(output, w)
+        else:
+            with atomicWrite(output) as f:
+                writeText(f, activities)
+    return findings
+
+if __name__ == '__main__':
+    from instrument import parseOptions
+    sys.argv[1:] = parseOptions(sys.argv[1:])
+    parser = argparse.ArgumentParser(description = "Check activity files")
+    parser.add_argument('file', nargs = '?', default = os.path.join(
+            os.getenv('HOME', ''), '.activity'), help = "activity file")
+    parser.add_argument('--partition', default = None,
+                        help = "partition file")
+    parser.add_argument('--repair', metavar = 'output', default = None,
+                        help = "write a repaired copy of the file")
+    args = parser.parse_args()
+    if args.repair is None:
+        try:
+            findings = checkFile(args.file, args.partition)
+        except UnsortedActivities as exc:
+            print ("Error: standard input is not sorted, %s" % exc,
+                   file = sys.stderr)
+            sys.exit(2)
+    else:
+        findings = repairFile(args.file, args.repair, args.partition)
+    n = 0
+    for finding in findings:
+        print (finding)
+        n += 1
+    print ("%d finding(s)." % n, file = sys.stderr)
+    sys.exit(1 if n > 0 and args.repair is None else 0)
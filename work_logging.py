@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2010, 2011 CNRS
+# Author: Florent Lamiraux
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED
+# TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Work logging
+
+  Usage: python work_logging.py [--sleep seconds] [--profile[=file]]
+                                command [arguments]
+
+  Commands:
+    toggle      finish the current activity, or start a new one,
+    switch      finish the current activity and start a new one,
+    statistics  display the times by element of the partition,
+    status      display the current activity, see status.py,
+    check       check the activity file, see validation.py,
+    timesheet   display a calendar timesheet, see timesheet.py,
+    convert     convert an activity file, see formats.py,
+    migrate     split the activity file by month, see shards.py,
+    report      display a team report, see team_report.py.
+
+  The activity file is ~/.activity and the partition file
+  ~/.activity-partition. Modules are only imported by the commands using
+  them, so that toggling an activity does not pay for the import of the
+  modules used by reports, see importBudget. Option --sleep waits before
+  exiting, so that the output can be read when the command runs in a
+  terminal opened by a hotkey. See instrument for option --profile.
+"""
+
+import os, sys
+
+importBudget = 0.03
+"""
+Maximal time in seconds to import the modules of commands toggle and
+switch, measured with python -X importtime by bench.py
+"""
+
+def _toggle (filename, partition, args) :
+    from start_or_stop import startOrStop
+    startOrStop(filename, partition)
+
+def _switch (filename, partition, args) :
+    from switch_activity import switchActivity
+    switchActivity(filename, partition)
+
+def _statistics (filename, partition, args) :
+    from statistics import statistics
+    statistics(filename, partition)
+
+def _script (module, *prefix) :
+    """
+    Return a command running the main block of a module with the arguments
+    of the command
+    """
+    def run (filename, partition, args) :
+        import runpy
+        sys.argv = [module + '.py'] + list(prefix) + args
+        runpy.run_module(module, run_name = '__main__', alter_sys = True)
+    return run
+
+commands = {
+    'toggle': _toggle,
+    'switch': _switch,
+    'statistics': _statistics,
+    'status': _script('status'),
+    'check': _script('validation'),
+    'timesheet': _script('timesheet'),
+    'convert': _script('formats', 'convert'),
+    'migrate': _script('shards', 'migrate'),
+    'report': _script('team_report'),
+    }
+
+def main (argv) :
+    """
+    Run a command and return the exit status
+    """
+    sleep = 0.
+    profile = None
+    argv = list(argv)
+    while len(argv) > 0 and argv[0].startswith('--'):
+        option = argv.pop(0)
+        if option == '--sleep' and len(argv) > 0:
+            sleep = float(argv.pop(0))
+        elif option.startswith('--sleep='):
+            sleep = float(option[len('--sleep='):])
+        elif option == '--profile' or option.startswith('--profile='):
+            profile = option[len('--profile='):] or '1'
+        else:
+            print (__doc__)
+            return 1
+    if len(argv) == 0 or not argv[0] in commands:
+        print (__doc__)
+        return 1
+    import instrument
+    instrument.configure(profile)
+    home = os.getenv('HOME')
+    filename = os.path.join(home, '.activity')
+    commands[argv[0]](filename, filename + '-partition', argv[1:])
+    if sleep > 0:
+        import time
+        time.sleep(sleep)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
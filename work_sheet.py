@@ -27,34 +27,98 @@
 # ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 # POSSIBILITY OF SUCH DAMAGE.
 
-import sys, time
-import csv
+import sys, os, time
+import bisect
+import itertools
+import contextlib
 import datetime as dt
 from activity import Activity, TagError
+from instrument import phase, count
 
-class CsvDialectComma (csv.Dialect) :
-    def __init__(self):
-        self.quotechar = '#'
-        self.delimiter = ','
-        self.quoting = csv.QUOTE_NONE
-        self.lineterminator = '\n'
-        csv.Dialect.__init__(self)
-
-class CsvDialectSemiColon (csv.Dialect) :
-    def __init__(self):
-        self.quotechar = '#'
-        self.delimiter = ';'
-        self.quoting = csv.QUOTE_NONE
-        self.lineterminator = '\n'
-        csv.Dialect.__init__(self)
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+def _csvDialect (delimiter) :
+    import csv
+    class Dialect (csv.Dialect) :
+        def __init__(self):
+            self.quotechar = '#'
+            self.delimiter = delimiter
+            self.quoting = csv.QUOTE_NONE
+            self.lineterminator = '\n'
+            csv.Dialect.__init__(self)
+    return Dialect
+
+_csvDialects = {'CsvDialectComma': ',', 'CsvDialectSemiColon': ';'}
+
+def __getattr__ (name) :
+    # CSV dialects CsvDialectComma and CsvDialectSemiColon are defined when
+    # first used, csv being slow to import.
+    delimiter = _csvDialects.get(name)
+    if delimiter is None:
+        raise AttributeError("module %r has no attribute %r" %
+                             (__name__, name))
+    dialect = _csvDialect(delimiter)
+    dialect.__name__ = dialect.__qualname__ = name
+    globals()[name] = dialect
+    return dialect
+
+@contextlib.contextmanager
+def atomicWrite (filename, mode = 'w') :
+    """
+    Write a file through a temporary file replacing it once on disk
+
+      Input:
+        - mode: the mode in which the temporary file is opened, None to
+                yield the path of the temporary file to a writer opening it
+                itself.
+      The temporary file is created in the directory of filename, with the
+      permissions of the former file or those of a new file. It is synced
+      before it atomically replaces filename, so that readers never see a
+      partly written file, and removed if writing fails.
+    """
+    import tempfile
+    directory, name = os.path.split(os.path.abspath(filename))
+    fd, tmp = tempfile.mkstemp(prefix = name + '.', suffix = '.tmp',
+                               dir = directory)
+    try:
+        try:
+            permissions = os.stat(filename).st_mode & 0o777
+        except FileNotFoundError:
+            umask = os.umask(0)
+            os.umask(umask)
+            permissions = 0o666 & ~umask
+        os.chmod(tmp, permissions)
+        if mode is None:
+            os.close(fd)
+            os.remove(tmp)
+            yield tmp
+        else:
+            with os.fdopen(fd, mode) as f:
+                yield f
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp, filename)
+    except:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
 
 class WorkSheet (object) :
     """
     List of activities
+
+      Indices on tags and starting times are built lazily. They follow
+      activities appended to the list or replacement of the list, other
+      in place modifications should go through methods of this class.
     """
     
     def __init__ (self) :
         self.activities = []
+        self.journalRecords = 0
+        self._resetIndex()
 
     def add (self, activity, ignorePartition = False) :
         """
@@ -63,46 +127,152 @@ class WorkSheet (object) :
         if not isinstance(activity, Activity) :
             raise TypeError("expecting an object of type Activity: got %s"%
                             repr(activity))
-        if not ignorePartition and len (activity.instanceTags.intersection
-                                        (Activity.partition)) != 1:
+        if not ignorePartition and not activity.inPartition():
             raise RuntimeError ("activity should contain one and only one " +
                                 "element of partition.")
         self.activities.append(activity)
 
+    def addRecord (self, activity, ignorePartition = False) :
+        """
+        Add an activity read from a journal
+
+          If the last activity is still open and starts at the same time as
+          the given activity, the latter is a closing record appended by
+          appendActivity and replaces the open activity.
+        """
+        if len(self.activities) > 0 and self.activities[-1].endTime is None \
+                and self.activities[-1].startTime == activity.startTime:
+            self.activities.pop()
+            self._resetIndex()
+            self.journalRecords += 1
+        self.add(activity, ignorePartition)
+
     def write(self, filename) :
         """
         Write the work sheet in a file
+
+          See atomicWrite. Writers should hold lockFile(filename).
         """
-        self.sort()
-        with open(filename, 'w') as f :
-            f.write(str(self))
+        if not self.isSorted():
+            self.sort()
+        with atomicWrite(filename) as f, phase('write'):
+            n = writeText(f, self.activities)
+        count('characters written', n)
 
     def read(self, filename, ignorePartition = False) :
         """
         Read a work sheet in a file
         """
-        
-        with open(filename, 'r') as f :
-            reader = csv.reader(f, dialect = CsvDialectSemiColon())
-            ln = 0
-            for row in reader :
-                ln += 1
-                a = Activity.fromList(row)
-                self.add(a, ignorePartition)
+        with phase('read'), open(filename, 'r') as f :
+            self.readLines(f, ignorePartition)
+            count('bytes read', f.tell())
+
+    def readLines(self, lines, ignorePartition = False) :
+        """
+        Read a work sheet from an iterable over lines of text or bytes
+        """
+        rows = len(self.activities) + self.journalRecords
+        for line in lines :
+            a = Activity.fromLine(line)
+            self.addRecord(a, ignorePartition)
+        rows = len(self.activities) + self.journalRecords - rows
+        count('rows parsed', rows)
+        if not ignorePartition:
+            count('partition checks', rows)
 
     def sort(self) :
-        self.activities.sort()
-        
+        with phase('sort'):
+            self.activities.sort()
+        self._resetIndex()
+
+    def _resetIndex(self) :
+        self._indexedList = self.activities
+        self._maskIndex = {}
+        self._maskIndexed = 0
+        self._startTimes = []
+        self._sorted = True
+
+    def _checkIndex(self) :
+        """
+        Reset indices if the list of activities has been replaced or shrunk
+        """
+        if self._indexedList is not self.activities or \
+                self._maskIndexed > len(self.activities) or \
+                len(self._startTimes) > len(self.activities):
+            self._resetIndex()
+
+    def maskIndex(self) :
+        """
+        Return a dictionary mapping each mask of tags to the sorted list of
+        positions of the activities having these tags
+
+          See activity.TagRegistry. The index is built lazily and extended
+          with activities appended since last call. Tags of indexed
+          activities should not be modified.
+        """
+        self._checkIndex()
+        index = self._maskIndex
+        count('mask index rows', len(self.activities) - self._maskIndexed)
+        mask = Activity.registry.mask
+        for i in range(self._maskIndexed, len(self.activities)):
+            m = mask(self.activities[i].instanceTags)
+            positions = index.get(m)
+            if positions is None:
+                index[m] = [i]
+            else:
+                positions.append(i)
+        self._maskIndexed = len(self.activities)
+        return index
+
+    def _maskPositions(self, select) :
+        """
+        Return the sorted positions of the activities whose mask of tags
+        satisfies a predicate
+        """
+        lists = [l for m, l in self.maskIndex().items() if select(m)]
+        if len(lists) == 1:
+            return lists[0]
+        return sorted(itertools.chain.from_iterable(lists))
+
+    def startTimes(self) :
+        """
+        Return the list of starting times of the activities
+
+          The list is built lazily and extended with activities appended
+          since last call. Starting times of indexed activities should not be
+          modified.
+        """
+        self._checkIndex()
+        starts = self._startTimes
+        count('start index rows', len(self.activities) - len(starts))
+        for a in self.activities[len(starts):]:
+            if len(starts) > 0 and a.startTime < starts[-1]:
+                self._sorted = False
+            starts.append(a.startTime)
+        return starts
+
+    def isSorted(self) :
+        """
+        Whether activities are sorted by starting time
+        """
+        self.startTimes()
+        return self._sorted
+
+    def _extractPositions(self, positions) :
+        w = WorkSheet()
+        for i in positions:
+            a = self.activities[i]
+            if not a.endTime is None:
+                w.activities.append(a)
+        return w
+
     def __add__ (self, other):
         res = WorkSheet ()
         res.activities = self.activities + other.activities
         return res
 
     def __str__(self) :
-        string = ""
-        for a in self.activities :
-            string += str(a)+'\n'
-        return string
+        return ''.join([str(a) + '\n' for a in self.activities])
 
     def __getitem__(self, key) :
         return self.activities[key]
@@ -114,11 +284,7 @@ class WorkSheet (object) :
         """
         Check that given set of tags is included in class set
         """
-        if not isinstance(tagSet, set):
-            raise TagError("%s is not a set." % tagSet)
-        for tag in tagSet :
-            if tag not in Activity.tags:
-                raise TagError("'%s' is not a known tag." % tag)
+        checkTags(tagSet)
 
     def extractUnion(self, tags) :
         """
@@ -126,13 +292,12 @@ class WorkSheet (object) :
         
           Return a work sheet containing the selected activities
           """
+        count('tag extractions')
         tagSet = set(tags)
         self.checkTags(tagSet)
-        w = WorkSheet()
-        for a in self.activities:
-            if not tagSet.isdisjoint(a.instanceTags) and not a.endTime is None:
-                w.activities.append(a)
-        return w
+        query = Activity.registry.mask(tagSet)
+        return self._extractPositions(self._maskPositions
+                                      (lambda m : m & query))
 
     def extractInter(self, tags) :
         """
@@ -140,14 +305,12 @@ class WorkSheet (object) :
 
           Return a work sheet containing the selected activities.
         """
+        count('tag extractions')
         tagSet = set(tags)
         self.checkTags(tagSet)
-        self.checkTags(tagSet)
-        w = WorkSheet()
-        for a in self.activities:
-            if tagSet.issubset(a.instanceTags) and not a.endTime is None:
-                w.activities.append(a)
-        return w
+        query = Activity.registry.mask(tagSet)
+        return self._extractPositions(self._maskPositions
+                                      (lambda m : m & query == query))
 
 
     @property
@@ -155,10 +318,7 @@ class WorkSheet (object) :
         """
         Return total time in hours
         """
-        time = dt.timedelta(0)
-        for a in self.activities:
-            time += a.duration
-        return time.days*24 + time.seconds/3600.
+        return sumTime(self.activities)
 
     def extract(self, predicate) :
         """
@@ -167,17 +327,28 @@ class WorkSheet (object) :
           Input:
             - a predicate.
         """
+        count('extract scans')
         w = WorkSheet()
-        for a in self.activities:
-            if predicate(a):
-                w.activities.append(a)
+        with phase('extract scan'):
+            for a in self.activities:
+                if predicate(a):
+                    w.activities.append(a)
         return w
 
     def extractBetween(self, start, end) :
         """
         Extract activities starting between two datetime objects
+
+          If the work sheet is sorted, the bounds are found by binary search.
         """
-        return self.extract(lambda x : start <= x.startTime <= end)
+        starts = self.startTimes()
+        if not self._sorted:
+            return self.extract(lambda x : start <= x.startTime <= end)
+        count('extract bisections')
+        w = WorkSheet()
+        w.activities = self.activities[bisect.bisect_left(starts, start):
+                                       bisect.bisect_right(starts, end)]
+        return w
 
     def extractDay(self, year, month, day) :
         """
@@ -185,8 +356,7 @@ class WorkSheet (object) :
         """
         init = dt.datetime(year = year, month = month, day = day)
         end = init + dt.timedelta(days=1)
-        predicate = lambda x: init <= x.startTime <= end
-        return self.extract(predicate)
+        return self.extractBetween(init, end)
 
     def extractMonth(self, year, month) :
         """
@@ -201,61 +371,569 @@ class WorkSheet (object) :
             end = dt.datetime(year = year, month = month + 1, day=1)
         else:
             end = dt.datetime(year = year+1, month = 1, day=1)
-        predicate = lambda x: init <= x.startTime <= end
-        return self.extract(predicate)
+        return self.extractBetween(init, end)
+
+    def closedAt(self, time) :
+        """
+        Return a work sheet where the last activity, if not finished, is
+        finished at a given time
+
+          The activities of this work sheet are not modified.
+        """
+        w = WorkSheet()
+        w.activities = self.activities[:]
+        if len(w) > 0 and w[-1].endTime is None:
+            a = Activity()
+            a.startTime = w[-1].startTime
+            a.endTime = time
+            a.description = w[-1].description
+            a.instanceTags = w[-1].instanceTags
+            w.activities[-1] = a
+        return w
+
+    def extractToday(self, now = None) :
+        """
+        Extract activities starting today, the current activity being
+        finished now
+        """
+        if now is None:
+            now = dt.datetime.now()
+        return self.extractDay(year = now.year, month = now.month,
+                               day = now.day).closedAt(now)
+
+    def extractThisWeek(self, now = None) :
+        """
+        Extract activities starting this week, the current activity being
+        finished now
+        """
+        if now is None:
+            now = dt.datetime.now()
+        return self.extractBetween(_mondayMorning(now), now).closedAt(now)
+
+    def extractThisMonth(self, now = None) :
+        """
+        Extract activities starting this month, the current activity being
+        finished now
+        """
+        if now is None:
+            now = dt.datetime.now()
+        return self.extractBetween(_firstOfMonth(now), now).closedAt(now)
 
     def totalTimeByTag(self):
-        result = {}
-        tags = set()
-        for a in self.activities:
-            tags = tags.union(a.instanceTags)
-        for t in tags:
-            result[t] = self.extractInter(set([t])).totalTime
-        return result
-
-    def check (self):
-        for a1, a2 in zip (self.activities, self.activities [1:]):
-            if (a1.endTime > a2.startTime or
-                a1.duration < dt.timedelta(0,0) or
-                a1.duration > dt.timedelta(1, 0)):
-                print ("{0}:\t {1}".format (a1.startTime, a1.description))
+        """
+        Return a dictionary giving the total time in hours for each tag
+
+          The time of each activity is added to all its tags in one pass.
+        """
+        return sumTimeByTag(self.activities)
+
+    def check (self, display = True):
+        """
+        Return the list of the defects of the activities
+
+          Input:
+            - display: whether to print the findings.
+          See validation.checkWorkSheet.
+        """
+        import validation
+        findings = validation.checkWorkSheet(self)
+        if display:
+            for f in findings:
+                print (f)
+        return findings
+
+def checkTags (tagSet) :
+    """
+    Check that given set of tags is included in class set
+    """
+    if not isinstance(tagSet, set):
+        raise TagError("%s is not a set." % tagSet)
+    # Known tags are registered by knownMask: tags still not registered are
+    # unknown and should not be registered.
+    known = Activity.knownMask()
+    for t in tagSet:
+        if t not in Activity.registry.ids:
+            raise TagError("'%s' is not a known tag." % t)
+    unknown = Activity.registry.mask(tagSet) & ~known
+    if unknown:
+        raise TagError("'%s' is not a known tag." %
+                       next(Activity.registry.iterTags(unknown)))
+
+batchSize = 4096
+"""
+Number of lines formatted before each write by writeText
+"""
+
+def writeText (f, activities) :
+    """
+    Write activities in a text file, one line per activity
+
+      Lines are formatted and written in batches of batchSize lines, so
+      that only one batch is in memory. Return the number of characters
+      written.
+    """
+    n = 0
+    batch = []
+    for a in activities:
+        batch.append(str(a))
+        if len(batch) == batchSize:
+            batch.append('')
+            n += f.write('\n'.join(batch))
+            batch = []
+    if len(batch) > 0:
+        batch.append('')
+        n += f.write('\n'.join(batch))
+    return n
+
+databaseMagic = b'SQLite format 3\0'
+
+def isDatabase (filename) :
+    """
+    Whether an activity file is a SQLite database, see sqlite_sheet
+    """
+    try:
+        with open(filename, 'rb') as f:
+            return f.read(len(databaseMagic)) == databaseMagic
+    except (IOError, OSError):
+        return False
+
+def _lines (filename) :
+    """
+    Iterate over the lines of a file, or of the standard input if filename
+    is '-'
+    """
+    if filename == '-':
+        yield from sys.stdin.buffer
+        return
+    if os.path.isdir(filename):
+        import shards
+        for key in shards.Manifest.load(filename).keys():
+            yield from _lines(shards.shardFile(filename, key))
+        return
+    with open(filename, 'rb') as f:
+        yield from f
+
+def iterActivities (filename, partition = None) :
+    """
+    Iterate over the activities of a file without building a work sheet
+
+      Input:
+        - filename: the activity file, '-' for the standard input,
+        - partition: the partition file, None to skip the partition check.
+      As in WorkSheet.addRecord, an open activity followed by an activity
+      starting at the same time is replaced by the latter. Only one activity
+      is kept in memory.
+    """
+    ignorePartition = partition is None
+    if not ignorePartition:
+        Activity.readPartition (partition)
+    if filename != '-' and isDatabase(filename):
+        import sqlite_sheet
+        activities = sqlite_sheet.iterDatabase(filename)
+    else:
+        activities = map(Activity.fromLine, _lines(filename))
+    previous = None
+    rows = 0
+    try:
+        for a in activities:
+            rows += 1
+            if not ignorePartition and not a.inPartition():
+                raise RuntimeError ("activity should contain one and only " +
+                                    "one element of partition.")
+            if previous is not None and not (previous.endTime is None and
+                                             previous.startTime ==
+                                             a.startTime):
+                yield previous
+            previous = a
+        if previous is not None:
+            yield previous
+    finally:
+        count('rows parsed', rows)
+
+def filterBetween (activities, start, end, sortedInput = False) :
+    """
+    Filter activities starting between two datetime objects
+
+      If sortedInput is True, iteration stops at the first activity starting
+      after end.
+    """
+    for a in activities:
+        if a.startTime > end:
+            if sortedInput:
+                return
+            continue
+        if a.startTime >= start:
+            yield a
+
+def filterUnion (activities, tags) :
+    """
+    Filter activities related to given set of tags
+    """
+    tagSet = set(tags)
+    checkTags(tagSet)
+    query = Activity.registry.mask(tagSet)
+    mask = Activity.registry.mask
+    return (a for a in activities if mask(a.instanceTags) & query)
+
+def filterInter (activities, tags) :
+    """
+    Filter activities related to all tags in a given set
+    """
+    tagSet = set(tags)
+    checkTags(tagSet)
+    if len(tagSet) == 0:
+        return iter(activities)
+    query = Activity.registry.mask(tagSet)
+    mask = Activity.registry.mask
+    return (a for a in activities if mask(a.instanceTags) & query == query)
+
+def filterOpen (activities) :
+    """
+    Filter activities not finished yet
+    """
+    return (a for a in activities if a.endTime is None)
+
+def filterClosed (activities) :
+    """
+    Filter finished activities
+    """
+    return (a for a in activities if a.endTime is not None)
+
+def closeAt (activities, time) :
+    """
+    Finish activities not finished yet at a given time
+
+      Same as WorkSheet.closedAt: the activities are not modified.
+    """
+    for a in activities:
+        if a.endTime is None:
+            closed = Activity()
+            closed.startTime = a.startTime
+            closed.endTime = time
+            closed.description = a.description
+            closed.instanceTags = a.instanceTags
+            a = closed
+        yield a
+
+def sumTime (activities) :
+    """
+    Return total time of activities in hours
+    """
+    time = dt.timedelta(0)
+    for a in activities:
+        time += a.duration
+    return _hours(time)
+
+def sumTimeByTag (activities) :
+    """
+    Return a dictionary giving the total time of activities in hours for
+    each tag
+
+      Durations are summed by set of tags, then by tag.
+    """
+    byMask = {}
+    zero = dt.timedelta(0)
+    mask = Activity.registry.mask
+    for a in activities:
+        m = mask(a.instanceTags)
+        byMask[m] = byMask.get(m, zero) + a.duration
+    times = {}
+    for m, d in byMask.items():
+        for t in Activity.registry.iterTags(m):
+            times[t] = times.get(t, zero) + d
+    return dict((t, _hours(d)) for t, d in times.items())
 
 def readFile (filename, partition) :
     """
     Read files filename and partition and return the correponding work sheet
+
+      If filename is a directory of shards, they are read when needed, see
+      shards.ShardedWorkSheet. If filename is a database, see
+      sqlite_sheet.DatabaseWorkSheet.
     """
     if not partition is None:
         Activity.readPartition (partition)
+    if os.path.isdir(filename):
+        import shards
+        return shards.ShardedWorkSheet(filename, partition)
+    if isDatabase(filename):
+        import sqlite_sheet
+        return sqlite_sheet.readDatabase(filename, partition)
     w = WorkSheet()
     w.read (filename, partition is None)
     return w
 
-def workToday(filename, partition) :
-    w = readFile(filename, partition)
+secondsPerDay = 86400
+
+def _hours (time) :
+    """
+    Convert a timedelta object in hours
+    """
+    return time.days*24 + time.seconds/3600.
+
+def _reverseLines (filename, blockSize = 4096) :
+    """
+    Iterate over the lines of a file from the last one to the first one
+
+      The file is read backwards from its end by blocks.
+    """
+    with open(filename, 'rb') as f:
+        pos = f.seek(0, os.SEEK_END)
+        rest = b''
+        while pos > 0:
+            size = min(blockSize, pos)
+            pos -= size
+            f.seek(pos)
+            count('bytes read', size)
+            lines = (f.read(size) + rest).split(b'\n')
+            rest = lines[0]
+            for line in reversed(lines[1:]):
+                if line:
+                    yield line.decode()
+        if rest:
+            yield rest.decode()
+
+def readTail (filename, n, partition = None) :
+    """
+    Read the last n activities of a file and return them in a work sheet
+
+      Only the end of the file is read and parsed, so that the cost does not
+      depend on the length of the history.
+    """
+    if not partition is None:
+        Activity.readPartition (partition)
+    if os.path.isdir(filename):
+        import shards
+        return shards.readShardsTail(filename, n, partition)
+    if isDatabase(filename):
+        import sqlite_sheet
+        return sqlite_sheet.readDatabaseTail(filename, n, partition)
+    # An activity takes at most two lines: an open record and a closing one.
+    with phase('read tail'):
+        lines = list(itertools.islice(_reverseLines(filename), 2*n))
+        lines.reverse()
+        w = WorkSheet()
+        w.readLines(lines, partition is None)
+    w.activities = w.activities[-n:]
+    return w
+
+sinceWindow = 64
+"""
+Number of lines read by readSince before the first line starting before the
+requested time to check that the file is sorted.
+"""
+def _linesSince (filename, start) :
+    """
+    Return the lines of a file describing activities starting after start
+    """
+    lines = []
+    later = None
+    window = None
+    for line in _reverseLines(filename):
+        t = Activity.listToDatetime(line.split(';', 1)[0])
+        if later is not None and t > later:
+            break
+        later = t
+        if t >= start:
+            if window is not None:
+                break
+            lines.append(line)
+        elif window is None:
+            window = sinceWindow
+        else:
+            window -= 1
+            if window == 0:
+                lines.reverse()
+                return lines
+    else:
+        lines.reverse()
+        return lines
+    # Lines are out of order: read the whole file
+    count('unsorted reads')
+    with open(filename) as f:
+        return [line for line in f if line.strip() and
+                Activity.listToDatetime(line.split(';', 1)[0]) >= start]
+
+def readSince (filename, start, partition = None) :
+    """
+    Read activities starting after a datetime object and return them in a
+    work sheet
+
+      The file is read backwards from its end. Reading stops sinceWindow
+      lines after the first activity starting before start, unless these
+      lines are out of order, in which case the whole file is read.
+    """
+    if not partition is None:
+        Activity.readPartition (partition)
+    if os.path.isdir(filename):
+        import shards
+        return shards.readShards(filename, partition, start)\
+            .extract(lambda a : a.startTime >= start)
+    if isDatabase(filename):
+        import sqlite_sheet
+        return sqlite_sheet.readDatabaseSince(filename, start, partition)
+    with phase('read since'):
+        lines = _linesSince(filename, start)
+        w = WorkSheet()
+        w.readLines(lines, partition is None)
+    return w
+
+class ConcurrentModification (RuntimeError) :
+    """
+    Raised when a file was modified since it was read
+    """
+    pass
+
+def fileStamp (filename) :
+    """
+    Return the size and modification time of a file, None if it does not
+    exist
+
+      A writer compares the stamp of a file when read to its stamp when
+      holding the lock, and reads the file again if they differ.
+    """
+    if os.path.isdir(filename):
+        import shards
+        filename = shards.manifestFile(filename)
+    try:
+        st = os.stat(filename)
+    except FileNotFoundError:
+        return None
+    return st.st_size, st.st_mtime_ns
+
+_locks = {}
+"""
+Number of nested lockFile contexts by file, for the current process
+"""
+
+@contextlib.contextmanager
+def lockFile (filename, stamp = None) :
+    """
+    Hold an exclusive advisory lock on an activity file
+
+      The lock is taken with fcntl.flock on filename + '.lock', if fcntl is
+      available. Nested contexts on the same file do not lock again.
+      Input:
+        - stamp: the stamp of the file when read, if any. Raise
+                 ConcurrentModification if the file was modified since.
+    """
+    key = os.path.abspath(filename)
+    if _locks.get(key, 0) > 0 or fcntl is None:
+        f = None
+    else:
+        f = open(filename + '.lock', 'a')
+        with phase('lock wait'):
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+    _locks[key] = _locks.get(key, 0) + 1
+    try:
+        if stamp is not None and fileStamp(filename) != stamp:
+            raise ConcurrentModification("%s was modified meanwhile." %
+                                         filename)
+        yield
+    finally:
+        _locks[key] -= 1
+        if f is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            f.close()
+
+def appendActivity (filename, activity, stamp = None) :
+    """
+    Append an activity at the end of a file without rewriting it
+
+      If the activity closes the last activity of the file, the appended line
+      is a closing record that replaces the open activity when the file is
+      read. Call compactFile to merge closing records.
+      Input:
+        - stamp: see lockFile.
+    """
+    if os.path.isdir(filename):
+        import shards
+        with lockFile(filename, stamp), phase('append'):
+            shards.appendShard(filename, activity)
+        return
+    if isDatabase(filename):
+        import sqlite_sheet
+        with lockFile(filename, stamp), phase('append'):
+            sqlite_sheet.appendRecord(filename, activity)
+        return
+    with lockFile(filename, stamp), phase('append'):
+        with open(filename, 'a') as f :
+            f.write(str(activity)+'\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+def compactFile (filename, partition, w = None, stamp = None) :
+    """
+    Rewrite a file appended to by appendActivity, merging closing records
+
+      Input:
+        - w: the work sheet already read from the file, if any,
+        - stamp: the stamp of the file when w was read, see lockFile.
+      Files are written with atomicWrite, databases in one transaction.
+    """
+    with lockFile(filename, stamp), phase('compact'):
+        if w is None:
+            w = readFile(filename, partition)
+        if os.path.isdir(filename):
+            import shards
+            shards.writeShards(filename, w)
+        elif isDatabase(filename):
+            import sqlite_sheet
+            sqlite_sheet.writeDatabase(filename, w)
+        else:
+            w.write(filename)
+    return w
+
+def _thisMorning(now) :
+    return dt.datetime(year = now.year,
+                       month = now.month,
+                       day = now.day,
+                       hour=0, minute=0, second=0, microsecond=0)
+
+def _mondayMorning(now) :
+    return _thisMorning(now) + dt.timedelta(days=-now.weekday())
+
+def _firstOfMonth(now) :
+    return dt.datetime(year = now.year,
+                       month = now.month,
+                       day = 1,
+                       hour=0, minute=0, second=0, microsecond=0)
+
+def workToday(filename, partition, w = None) :
+    """
+    Return activities of today
+
+      Input:
+        - w: the work sheet read from filename if already available. If None,
+             only today activities are read in filename.
+    """
     now = dt.datetime.now()
-    if w[-1].endTime is None:
-        w[-1].endTime = now
-    return w.extractDay(year = now.year, month = now.month, day = now.day)
+    if w is None:
+        w = readSince(filename, _thisMorning(now), partition)
+    return w.extractToday(now)
+
+def workThisWeek(filename, partition, w = None) :
+    """
+    Return activities of this week
 
-def workThisWeek(filename, partition) :
-    w = readFile(filename, partition)
+      Input:
+        - w: the work sheet read from filename if already available. If None,
+             only this week activities are read in filename.
+    """
     now = dt.datetime.now()
-    if w[-1].endTime is None:
-        w[-1].endTime = now
-    thisMorning = dt.datetime(year = now.year,
-                              month = now.month,
-                              day = now.day,
-                              hour=0, minute=0, second=0, microsecond=0)
-    mondayMorning = thisMorning + dt.timedelta(days=-now.weekday())
-    return w.extractBetween(mondayMorning, now)
-
-def workThisMonth(filename, partition) :
-    w = readFile(filename, partition)
+    if w is None:
+        w = readSince(filename, _mondayMorning(now), partition)
+    return w.extractThisWeek(now)
+
+def workThisMonth(filename, partition, w = None) :
+    """
+    Return activities of this month
+
+      Input:
+        - w: the work sheet read from filename if already available. If None,
+             only this month activities are read in filename.
+    """
     now = dt.datetime.now()
-    if w[-1].endTime is None:
-        w[-1].endTime = now
-    beginning = dt.datetime(year = now.year,
-                            month = now.month,
-                            day = 1,
-                            hour=0, minute=0, second=0, microsecond=0)
-    return w.extractBetween(beginning, now)
+    if w is None:
+        w = readSince(filename, _firstOfMonth(now), partition)
+    return w.extractThisMonth(now)